@@ -1,11 +1,91 @@
 #include <string>
+#include <vector>
+#include <cstdio>
+#include <cstdlib>
+#include <cstring>
+#include <cstdint>
+#include <unistd.h>
+#include <sys/socket.h>
+#include <sys/un.h>
+#include <arpa/inet.h>
 
-int main(int argc, const char* argv[]) {
-    std::string command = "python3 ~/Library/com.UmActually.Autopilot/main.py";
+// Thin client of the Autopilot server (autopilot --server). The working dir, the arguments and the
+// stdin, stdout & stderr of this process are sent over a Unix domain socket, so the already-warm
+// server runs the command right in this terminal. Returns -1 if the server isn't running.
+int run_on_server(const std::string& socket_path, int argc, const char* argv[]) {
+    int sock = socket(AF_UNIX, SOCK_STREAM, 0);
+    if (sock < 0)
+        return -1;
+    sockaddr_un addr = {};
+    addr.sun_family = AF_UNIX;
+    strncpy(addr.sun_path, socket_path.c_str(), sizeof(addr.sun_path) - 1);
+    if (connect(sock, (sockaddr*) &addr, sizeof(addr)) != 0) {
+        close(sock);
+        return -1;
+    }
+
+    // Request: payload length, then the working dir and the arguments, separated by null chars.
+    char cwd[4096];
+    if (getcwd(cwd, sizeof(cwd)) == nullptr)
+        strcpy(cwd, "/");
+    std::string payload = cwd;
     for (int i = 1; i < argc; ++i) {
-        command += " ";
-        command += argv[i];
+        payload += '\0';
+        payload += argv[i];
+    }
+    uint32_t length = htonl(payload.size());
+    std::string request((char*) &length, 4);
+    request += payload;
+
+    int fds[3] = {0, 1, 2};
+    char control[CMSG_SPACE(sizeof(fds))] = {};
+    iovec iov = {(void*) request.data(), request.size()};
+    msghdr msg = {};
+    msg.msg_iov = &iov;
+    msg.msg_iovlen = 1;
+    msg.msg_control = control;
+    msg.msg_controllen = sizeof(control);
+    cmsghdr* cmsg = CMSG_FIRSTHDR(&msg);
+    cmsg->cmsg_level = SOL_SOCKET;
+    cmsg->cmsg_type = SCM_RIGHTS;
+    cmsg->cmsg_len = CMSG_LEN(sizeof(fds));
+    memcpy(CMSG_DATA(cmsg), fds, sizeof(fds));
+
+    ssize_t sent = sendmsg(sock, &msg, 0);
+    if (sent < 0) {
+        close(sock);
+        return -1;
+    }
+    if ((size_t) sent < request.size() &&
+            send(sock, request.data() + sent, request.size() - sent, 0) < 0) {
+        close(sock);
+        return 1;
     }
-    system(command.c_str());
-    return 0;
+
+    // Response: the exit code of the command.
+    int32_t code;
+    ssize_t received = recv(sock, &code, sizeof(code), MSG_WAITALL);
+    close(sock);
+    if (received != sizeof(code))
+        return 1;
+    return (int) ntohl(code);
+}
+
+int main(int argc, const char* argv[]) {
+    const char* home = getenv("HOME");
+    std::string base = std::string(home ? home : "") + "/Library/com.UmActually.Autopilot/";
+
+    int code = run_on_server(base + "autopilot.sock", argc, argv);
+    if (code >= 0)
+        return code;
+
+    // The server isn't running: become the Python process instead.
+    std::string script = base + "main.py";
+    std::vector<char*> args = {(char*) "python3", (char*) script.c_str()};
+    for (int i = 1; i < argc; ++i)
+        args.push_back((char*) argv[i]);
+    args.push_back(nullptr);
+    execvp("python3", args.data());
+    perror("autopilot");
+    return 1;
 }
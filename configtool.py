@@ -1,11 +1,10 @@
-from typing import Optional, Any, Tuple
+from typing import Optional, Any, Tuple, List, NamedTuple
 import shutil
 
-from model import Meeting, Time, Config
+from model import Meeting, Time, Config, find_overlaps
 import utils
 
 
-# TODO: system_profiler SPDisplaysDataType | grep Resolution
 # Many global vars are kept to avoid passing stuff around.
 main_menu = utils.pseudo_markdown(utils.open_file('Resources/configmenu.txt'))
 details = utils.distribute_list(
@@ -13,23 +12,45 @@ details = utils.distribute_list(
 sched = utils.pseudo_markdown(utils.open_file('Resources/schedulemenu.txt'))
 sched_dtl = utils.pseudo_markdown(utils.open_file('Resources/scheddetail.txt'))
 
+class Link(NamedTuple):
+    """Meeting ID and passcode of a typed ID or pasted link (see utils.parse_link)."""
+    zoom: int
+    pwd: Optional[str]
+
+    @classmethod
+    def from_string(cls, text: str) -> 'Link':
+        return cls(*utils.parse_link(text))
+
+
 opt_limits = [(0, 59), (1, 59), (100, 10000), (0, 10000)]
 tuples = [('name', str, 'Name?', None),
           ('days', list, 'Weekdays? (1-7, 1 is Monday, separate by spaces or commas)', (1, 7)),
           ('time', Time, 'Meeting time? (HH:MM, 24-hour)', None),
-          ('zoom', int, 'Meeting ID? (Number or link)', None)]
+          ('zoom', Link, 'Meeting ID? (Number or link)', None),
+          ('pwd', str, 'Passcode? (Optional, lets Autopilot join through a link instead of typing, - removes it)',
+           None),
+          ('duration', int, 'Duration in minutes? (Optional, used to detect overlapping meetings)', (1, 1440))]
 
 config: Optional[Config] = None
 schedule: Optional[list] = None
+# Row ids of the schedule entries, when the SQLite store is used.
+ids: Optional[List[int]] = None
 refresh = False
-size = shutil.get_terminal_size()
 
 
-def save_schedule():
-    """Saves schedule to JSON and ensures view is refreshed."""
+def save_schedule(index: int, deleted=False):
+    """Saves the entry at index (added, edited or deleted) and ensures view is refreshed. With the
+    SQLite store, only that row is written. Otherwise, the whole schedule is saved to JSON."""
     global refresh
     refresh = True
-    utils.open_file('Resources/schedule.json', schedule)
+    if Meeting.store is None:
+        utils.open_file('Resources/schedule.json', list(schedule))
+    elif deleted:
+        Meeting.store.delete(ids.pop(index))
+    elif index < len(ids):
+        Meeting.store.update(ids[index], schedule[index])
+    else:
+        ids.append(Meeting.store.insert(schedule[index]))
 
 
 def read_easily(value: Any) -> Any:
@@ -43,73 +64,144 @@ def read_easily(value: Any) -> Any:
 
 def meeting_view(meeting: Meeting, show_opts=True) -> str:
     """Builds the detailed view of a particular meeting."""
-    return '\n' * (size.lines // 4) + sched_dtl.format(
+    # The terminal size is read on every view: through the server, it's the one of each client.
+    return '\n' * (shutil.get_terminal_size().lines // 4) + sched_dtl.format(
         'New Meeting' if meeting.name is None else meeting.name,
         '...' if meeting.days is None else meeting.fmt_weekdays(),
         '...' if meeting.time is None else str(meeting.time),
-        '...' if meeting.zoom is None else meeting.zoom) + \
+        '...' if meeting.zoom is None else meeting.zoom,
+        '...' if meeting.duration is None else f'{meeting.duration} min') + \
         '[\033[1m0\033[0m] Go back, [\033[1m1\033[0m] Edit, [\033[1m2\033[0m] Delete' * show_opts
 
 
-def schedule_view() -> Tuple[str, int]:
-    """Builds the view of the schedule (meeting list)."""
-    global schedule
-    schedule = utils.open_file('Resources/schedule.json')
+def load_schedule():
+    """Reads the schedule (and the row ids, with the SQLite store)."""
+    global schedule, ids
+    if Meeting.store is None:
+        schedule = list(utils.open_file('Resources/schedule.json'))
+    else:
+        rows = Meeting.store.all()
+        ids = [row_id for row_id, _ in rows]
+        schedule = [meeting for _, meeting in rows]
+
+
+def schedule_view(page: int) -> Tuple[str, int, int]:
+    """Builds the view of a page of the schedule (meeting list). Only the meetings of the page are
+    rendered, as many as fit in the terminal. Returns the view, the page (within bounds) and the page count."""
+    columns, lines = shutil.get_terminal_size()
+    # Everything, prompt included, fits in one line less than the terminal, so that pressing enter doesn't scroll.
+    per_page = max(lines - sched.count('\n') - 8, 1)
+    pages = max(-(-len(schedule) // per_page), 1)
+    page = min(max(page, 0), pages - 1)
+    start = page * per_page
     sched_menu = sched
-    k = -1
-    for k, meeting in enumerate(schedule):
-        sched_menu += f'\n[\033[1m{k + 1}\033[0m] {meeting["name"]}'
-    sched_menu += '\n\n[\033[1m+\033[0m] Add class/meeting' \
+    for k, meeting in enumerate(schedule[start:start + per_page], start):
+        sched_menu += f'\n[\033[1m{k + 1}\033[0m] {meeting["name"][:columns - len(str(k + 1)) - 4]}'
+    # Blank lines keep the options in place on the last page.
+    sched_menu += '\n' * (per_page - len(schedule[start:start + per_page]))
+    if pages > 1:
+        sched_menu += f'\n\nPage {page + 1} of {pages}: [\033[1mn\033[0m] Next, [\033[1mp\033[0m] Previous'
+    else:
+        sched_menu += '\n'
+    sched_menu += '\n[\033[1m+\033[0m] Add class/meeting' \
                   '\n[\033[1m0\033[0m] Go back'
-    return sched_menu, (k + 1)
+    return sched_menu, page, pages
 
 
-def add_or_edit_meeting(index: Optional[int] = None, meeting: Optional[Meeting] = None) -> Meeting:
-    """Prompts the attributes of a new or existing meeting."""
+def conflicts(meeting: Meeting, index: int) -> List[str]:
+    """Names of the meetings of the schedule that would overlap with the given one, placed at index."""
+    meetings = list(map(Meeting.from_dict, schedule))
+    if index < len(meetings):
+        meetings[index] = meeting
+    else:
+        meetings.append(meeting)
+    return [meetings[j if k == index else k].name
+            for k, j in find_overlaps(meetings) if index in (k, j)]
+
+
+def add_or_edit_meeting(index: Optional[int] = None, meeting: Optional[Meeting] = None) -> Optional[Meeting]:
+    """Prompts the attributes of a new or existing meeting. The meeting isn't saved if it overlaps with
+    another one: the user can edit it again or discard the changes (None is returned for a new meeting)."""
     editing = index is not None
+    keep = editing
 
     def p(text: str) -> str:
-        if editing:
+        if keep:
             text = 'Leave blank to keep current value.\n' + text
         return text
 
-    if not editing:
+    if editing:
+        original = meeting
+        meeting = Meeting.from_dict(meeting.as_dict())
+    else:
+        index = len(schedule)
+        original = None
         meeting = Meeting()
         meeting.is_on_sched = True
         meeting.is_right_now = False
 
-    for attr, cls, prompt, limits in tuples:
-        value = utils.sometimes_trust_user_input(
-            meeting_view(meeting, show_opts=False), p(prompt), cls, limits, return_with_enter=editing)
-        if value is not None:
-            setattr(meeting, attr, value)
+    while True:
+        for attr, cls, prompt, limits in tuples:
+            value = utils.sometimes_trust_user_input(
+                meeting_view(meeting, show_opts=False), p(prompt), cls, limits,
+                return_with_enter=keep or attr in ('duration', 'pwd'))
+            if value is None:
+                continue
+            if attr == 'zoom':
+                # The passcode of a pasted link is kept. Leaving the passcode prompt that follows blank keeps it,
+                # unless the ID changed: the old passcode is that of another meeting.
+                meeting.pwd = value.pwd if value.zoom != meeting.zoom else value.pwd or meeting.pwd
+                meeting.zoom = value.zoom
+            elif attr == 'pwd' and value == '-':
+                meeting.pwd = None
+            else:
+                setattr(meeting, attr, value)
+
+        names = conflicts(meeting, index)
+        if not names:
+            break
+        choice = utils.never_trust_user_input(
+            meeting_view(meeting, show_opts=False) + 'This meeting overlaps with: ' + ', '.join(names) +
+            '\n\n[\033[1m0\033[0m] Discard changes, [\033[1m1\033[0m] Edit again', (0, 1))
+        if choice == 0:
+            return original
+        keep = True
 
     if editing:
         schedule[index] = meeting.as_dict()
     else:
         schedule.append(meeting.as_dict())
 
-    save_schedule()
+    save_schedule(index)
     return meeting
 
 
 def edit_schedule():
     """Show the schedule list and prompt for an option."""
-    sched_menu, count = schedule_view()
+    load_schedule()
     global refresh
     refresh = False
+    page = 0
+    screen = utils.Screen()
 
     # Select a meeting
     while True:
         if refresh:
             refresh = False
-            sched_menu, count = schedule_view()
-        index = utils.never_trust_user_input(sched_menu, (0, count), '+')
+            load_schedule()
+        sched_menu, page, pages = schedule_view(page)
+        special = ['+'] + ['n'] * (page < pages - 1) + ['p'] * (page > 0)
+        index = utils.never_trust_user_input(sched_menu, (0, len(schedule)), *special, screen=screen)
         if index == 0:
             return
+        if index in ('n', 'p'):
+            page += 1 if index == 'n' else -1
+            continue
         if index == '+':
             index = len(schedule)
             meeting = add_or_edit_meeting()
+            if meeting is None:
+                continue
         else:
             index -= 1
             meeting = Meeting.from_dict(schedule[index])
@@ -126,7 +218,7 @@ def edit_schedule():
                 continue
             if choice == 2:
                 del schedule[index]
-                save_schedule()
+                save_schedule(index, deleted=True)
                 break
 
 
@@ -137,7 +229,7 @@ def detail_view(index: int, limits: Optional[Tuple[int, int]] = None):
     title = title.format(read_easily(value))
 
     new_value = utils.sometimes_trust_user_input(
-        '\n' * (size.lines // 4) + '\n\n' + title + '\n\n' + desc,
+        '\n' * (shutil.get_terminal_size().lines // 4) + '\n\n' + title + '\n\n' + desc,
         prompt, type(value), limits, True, 2)
 
     if new_value is not None:
@@ -146,29 +238,31 @@ def detail_view(index: int, limits: Optional[Tuple[int, int]] = None):
 
 def launch(_config: Config):
     """Show the option list and prompt for an option.
-    This is the starting point of the config tool interface."""
+    This is the starting point of the config tool interface. Option changes are written once, on closing."""
     global config
     config = _config
 
-    while True:
-        values = map(read_easily, [v for v in config.dict.values()])
-        fmt_menu = main_menu.format(*values)
+    # The options are saved once, with "Save and close" (ctrl+C discards the changes).
+    with config.batch():
+        while True:
+            values = map(read_easily, [v for v in config.dict.values()])
+            fmt_menu = main_menu.format(*values)
 
-        choice = utils.never_trust_user_input(fmt_menu, (0, 10))
+            choice = utils.never_trust_user_input(fmt_menu, (0, 10))
 
-        # Save and close
-        if choice == 0:
-            break
+            # Save and close
+            if choice == 0:
+                break
 
-        # Edit schedule
-        if choice == 1:
-            edit_schedule()
-            continue
+            # Edit schedule
+            if choice == 1:
+                edit_schedule()
+                continue
 
-        # Every other case
-        limits = None
-        if choice in [2, 3]:
-            limits = opt_limits[choice - 2]
-        if choice in [9, 10]:
-            limits = opt_limits[choice - 7]
-        detail_view(choice - 2, limits)
+            # Every other case
+            limits = None
+            if choice in [2, 3]:
+                limits = opt_limits[choice - 2]
+            if choice in [9, 10]:
+                limits = opt_limits[choice - 7]
+            detail_view(choice - 2, limits)
@@ -0,0 +1,418 @@
+from typing import Any, Callable, Optional, Tuple, List, Dict, Iterator, Iterable, NamedTuple
+import re
+import csv
+import datetime
+
+from model import Meeting, Time, day_minutes, find_overlaps
+import utils
+
+
+# "autopilot --import FILE": adds the events of an iCalendar (.ics) or CSV export to the schedule. The file is
+# read line by line, so even huge exports never sit in memory. Events are merged with the existing schedule
+# through an index keyed by meeting ID: the occurrences of the same meeting at the same time only add weekdays.
+# Events that are over (one-off events in the past, recurrences that ended) are left out, and so are the imported
+# meetings that would overlap with others, like the config tool does. The schedule is written once, at the end
+# (atomically, or in one transaction with the SQLite store).
+weekdays = {'mo': 1, 'tu': 2, 'we': 3, 'th': 4, 'fr': 5, 'sa': 6, 'su': 7,
+            'lu': 1, 'ma': 2, 'mi': 3, 'ju': 4, 'vi': 5, 'sá': 6, 'do': 7}
+
+
+class Event(NamedTuple):
+    name: Optional[str]
+    time: Optional[Time]
+    days: List[int]
+    link: Optional[Tuple[int, Optional[str]]]
+    duration: Optional[int] = None
+    # Start of the last occurrence, None if the event recurs forever.
+    until: Optional[datetime.datetime] = None
+
+
+# iCalendar
+
+def unfold(lines: Iterable[str]) -> Iterator[str]:
+    """Join the content lines that were folded (continued lines start with a space or tab)."""
+    current = None
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if line[:1] in (' ', '\t'):
+            if current is not None:
+                current += line[1:]
+            continue
+        if current is not None:
+            yield current
+        current = line
+    if current:
+        yield current
+
+
+def split_property(line: str) -> Tuple[str, Dict[str, str], str]:
+    """Name, parameters and value of a content line, e.g. DTSTART;TZID=America/Mexico_City:20220704T080000."""
+    quoted = False
+    for k, char in enumerate(line):
+        if char == '"':
+            quoted = not quoted
+        elif char == ':' and not quoted:
+            break
+    else:
+        return line.upper(), {}, ''
+    name, *params = line[:k].split(';')
+    return name.upper(), dict(p.upper().split('=', 1) if '=' in p else (p.upper(), '') for p in params), line[k + 1:]
+
+
+def unescape(text: str) -> str:
+    return re.sub(r'\\(.)', lambda m: '\n' if m.group(1) in 'nN' else m.group(1), text)
+
+
+def ics_events(lines: Iterable[str]) -> Iterator[Dict[str, Tuple[Dict[str, str], str]]]:
+    """The properties of every VEVENT, one event at a time."""
+    event = None
+    depth = 0
+    for line in unfold(lines):
+        name, params, value = split_property(line)
+        if name == 'BEGIN':
+            if value.upper() == 'VEVENT':
+                event, depth = {}, 0
+            elif event is not None:
+                # Nested components (alarms) have properties of their own.
+                depth += 1
+        elif name == 'END' and event is not None:
+            if value.upper() == 'VEVENT':
+                yield event
+                event = None
+            else:
+                depth -= 1
+        elif event is not None and depth == 0:
+            event.setdefault(name, (params, value))
+
+
+zones: Dict[str, Optional[datetime.tzinfo]] = {}
+
+
+def zone_of(tzid: str) -> Optional[datetime.tzinfo]:
+    """The time zone of a TZID, or None if it is unknown (the times are then taken as local)."""
+    if tzid not in zones:
+        try:
+            from zoneinfo import ZoneInfo
+            zones[tzid] = ZoneInfo(tzid.strip('"'))
+        except Exception:
+            zones[tzid] = None
+    return zones[tzid]
+
+
+def parse_ics_datetime(params: Dict[str, str], value: str) -> Optional[datetime.datetime]:
+    """The local date & time of a DATE-TIME value, or None for all-day (DATE) values."""
+    value = value.strip()
+    if params.get('VALUE') == 'DATE' or len(value) < 15:
+        return
+    moment = datetime.datetime(int(value[:4]), int(value[4:6]), int(value[6:8]),
+                               int(value[9:11]), int(value[11:13]), int(value[13:15]))
+    zone = None
+    if value.endswith('Z'):
+        zone = datetime.timezone.utc
+    elif 'TZID' in params:
+        zone = zone_of(params['TZID'])
+    if zone is not None:
+        moment = moment.replace(tzinfo=zone).astimezone().replace(tzinfo=None)
+    return moment
+
+
+def parse_ics_until(value: str) -> Optional[datetime.datetime]:
+    """The local date & time of an RRULE UNTIL, a DATE-TIME or a DATE (the whole day, then)."""
+    value = value.strip()
+    if len(value) == 8:
+        return datetime.datetime(int(value[:4]), int(value[4:6]), int(value[6:8]), 23, 59, 59)
+    return parse_ics_datetime({}, value)
+
+
+def last_occurrence(start: datetime.datetime, days: List[int], freq: str, interval: int,
+                    until: Optional[datetime.datetime] = None, count: Optional[int] = None) -> datetime.datetime:
+    """Start of the last occurrence of a daily or weekly recurrence that ends, at the until date (or before it)
+    or after count occurrences."""
+    if freq == 'DAILY':
+        step = datetime.timedelta(days=interval)
+        if count is not None:
+            return start + step * (count - 1)
+        return start + step * max((until - start) // step, 0)
+    week_start = start.date() - datetime.timedelta(days=start.isoweekday() - 1)
+    if count is not None:
+        first = [day for day in days if day >= start.isoweekday()]
+        if count <= len(first):
+            date = week_start + datetime.timedelta(days=first[count - 1] - 1)
+        else:
+            weeks, k = divmod(count - len(first) - 1, len(days))
+            date = week_start + datetime.timedelta(weeks=(weeks + 1) * interval, days=days[k] - 1)
+        return datetime.datetime.combine(date, start.time())
+    date = until.date()
+    for _ in range(7 * interval):
+        moment = datetime.datetime.combine(date, start.time())
+        if date < start.date():
+            break
+        if moment <= until and date.isoweekday() in days and (date - week_start).days // 7 % interval == 0:
+            return moment
+        date -= datetime.timedelta(days=1)
+    return until
+
+
+def parse_ics_duration(value: str) -> Optional[int]:
+    """Minutes of a DURATION value, e.g. PT1H30M."""
+    match = re.fullmatch(r'\+?P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?', value.strip())
+    if match is None:
+        return
+    weeks, days, hours, minutes, _ = (int(g or 0) for g in match.groups())
+    return (weeks * 7 + days) * day_minutes + hours * 60 + minutes or None
+
+
+def ics_event(props: Dict[str, Tuple[Dict[str, str], str]]) -> Optional[Event]:
+    """The weekly meeting of an event. Daily and weekly recurrences are expanded into weekdays, other ones
+    (e.g. monthly) and one-off events are not weekly meetings: None is returned, like for cancelled and all-day
+    events. If the recurrence ends (UNTIL or COUNT), the start of its last occurrence is kept as until."""
+    if props.get('STATUS', ({}, ''))[1].upper() == 'CANCELLED' or 'DTSTART' not in props or 'RRULE' not in props:
+        return
+    start = parse_ics_datetime(*props['DTSTART'])
+    if start is None:
+        return
+
+    duration = None
+    if 'DTEND' in props:
+        end = parse_ics_datetime(*props['DTEND'])
+        if end is not None:
+            duration = int((end - start).total_seconds() // 60) or None
+    elif 'DURATION' in props:
+        duration = parse_ics_duration(props['DURATION'][1])
+
+    days = [start.isoweekday()]
+    rule = dict(part.split('=', 1) for part in props['RRULE'][1].upper().split(';') if '=' in part)
+    freq = rule.get('FREQ')
+    if freq not in ('WEEKLY', 'DAILY'):
+        return
+    if 'BYDAY' in rule:
+        # BYDAY is in the event's own time zone, which may fall on another day here.
+        naive = datetime.datetime.strptime(props['DTSTART'][1].strip()[:8], '%Y%m%d')
+        shift = (start.date() - naive.date()).days
+        days = [(weekdays[day[-2:].lower()] - 1 + shift) % 7 + 1
+                for day in rule['BYDAY'].split(',') if day[-2:].lower() in weekdays]
+    elif freq == 'DAILY':
+        days = list(range(1, 8))
+    days = sorted(set(days))
+    if not days:
+        return
+    until = None
+    interval = int(rule.get('INTERVAL') or 1)
+    if 'UNTIL' in rule:
+        bound = parse_ics_until(rule['UNTIL'])
+        if bound is not None:
+            until = last_occurrence(start, days, freq, interval, until=bound)
+    elif 'COUNT' in rule:
+        until = last_occurrence(start, days, freq, interval, count=int(rule['COUNT']))
+
+    text = ' '.join(unescape(props[key][1]) for key in ('URL', 'LOCATION', 'DESCRIPTION') if key in props)
+    summary = props.get('SUMMARY')
+    return Event(unescape(summary[1]).strip() if summary else None, Time(start.hour, start.minute),
+                 days, utils.find_id(text), duration, until)
+
+
+# CSV
+
+def parse_days(text: str) -> List[int]:
+    """Weekdays as numbers (1-7) or names, in English or Spanish, e.g. "1 3 5" or "Mon, Wed"."""
+    days = set()
+    for token in re.split(r'[\s,;/]+', text.strip().lower()):
+        if token.isdigit() and 1 <= int(token) <= 7:
+            days.add(int(token))
+        elif token[:2] in weekdays:
+            days.add(weekdays[token[:2]])
+    return sorted(days)
+
+
+def parse_clock(text: str) -> Optional[Time]:
+    """Time of the day, 24-hour or 12-hour, e.g. "8:00", "08:00:00" or "8:00 PM"."""
+    match = re.search(r'(\d{1,2}):(\d{2})(?::\d{2})?\s*(?:([ap])\.?\s*m\b\.?)?', text.lower())
+    if match is None:
+        return
+    hour, minute = int(match.group(1)), int(match.group(2))
+    if match.group(3) is not None:
+        hour = hour % 12 + 12 * (match.group(3) == 'p')
+    return Time(hour, minute)
+
+
+def field(row: Dict[str, Any], *names: str) -> str:
+    """The first non-empty column of the row among the given names (lowercase)."""
+    for name in names:
+        value = row.get(name)
+        if value:
+            return value
+    return ''
+
+
+def csv_event(row: Dict[str, Any]) -> Optional[Event]:
+    """The meeting of a CSV row. Columns are matched by name, e.g. those of Autopilot (name, days, time,
+    zoom, duration) or of calendar exports (Subject, Start Date, Start Time, End Time, Description, Location)."""
+    start = field(row, 'time', 'start time', 'start', 'begin')
+    time = parse_clock(start)
+    if time is None:
+        return
+    days = parse_days(field(row, 'days', 'weekdays', 'day', 'weekday'))
+    if not days:
+        # A one-off event (e.g. a row of a calendar export, with its start date), not a weekly meeting.
+        return
+
+    duration = field(row, 'duration')
+    if duration.strip().isdigit():
+        duration = int(duration) or None
+    else:
+        end = parse_clock(field(row, 'end time', 'end'))
+        duration = None if end is None else \
+            (end.minute_of_week(1) - time.minute_of_week(1)) % day_minutes or None
+
+    text = ' '.join(field(row, name) for name in
+                    ('zoom', 'meeting id', 'id', 'link', 'url', 'location', 'description', 'notes'))
+    link = utils.find_id(text)
+    if link is None and field(row, 'zoom', 'meeting id', 'id'):
+        try:
+            link = utils.parse_link(field(row, 'zoom', 'meeting id', 'id'))
+        except ValueError:
+            pass
+    return Event(field(row, 'name', 'subject', 'summary', 'title').strip() or None, time, days, link, duration)
+
+
+def csv_rows(lines: Iterable[str]) -> Iterator[Dict[str, str]]:
+    """Every row as a dict, keyed by the lowercase column names of the header."""
+    reader = csv.reader(lines)
+    header = [column.strip().lower() for column in next(reader, [])]
+    for row in reader:
+        yield dict(zip(header, row))
+
+
+# Merging
+
+class Importer:
+    """Merges events into a copy of the schedule. Entries are indexed by meeting ID, then by time and end (see
+    Meeting.until): only events that end together are merged, so that the weekdays of one don't outlive it."""
+    def __init__(self, schedule: List[dict]):
+        self.schedule = schedule
+        self.index: Dict[int, Dict[Tuple[int, int, Optional[str]], dict]] = {}
+        for entry in schedule:
+            if entry['time'] is not None:
+                self.index.setdefault(entry['zoom'], {}).setdefault((*entry['time'], entry.get('until')), entry)
+        self.now = utils.time()
+        # Entries the import added or changed (by id), with the number of events merged into them,
+        # and the weekdays the changed ones had before.
+        self.events: Dict[int, int] = {}
+        self.original: Dict[int, List[int]] = {}
+        self.counts = dict(events=0, added=0, merged=0, duplicates=0, skipped=0, no_id=0, past=0, overlaps=0)
+
+    def add(self, parse: Callable[[Any], Optional[Event]], item: Any):
+        """Parse an event (ICS properties or CSV row) and merge it. Malformed events are skipped."""
+        self.counts['events'] += 1
+        try:
+            event = parse(item)
+        except (ValueError, KeyError):
+            event = None
+        if event is None or not event.days:
+            self.counts['skipped'] += 1
+            return
+        if event.until is not None and event.until < self.now:
+            self.counts['past'] += 1
+            return
+        if event.link is None:
+            self.counts['no_id'] += 1
+            return
+        zoom, pwd = event.link
+        meeting = Meeting(event.time, zoom, event.name or f'Meeting {zoom}', event.days, True, event.duration, pwd,
+                          event.until)
+        until = meeting.as_dict()['until']
+        entries = self.index.setdefault(zoom, {})
+        forever = entries.get((event.time.hour, event.time.minute, None))
+        if until is not None and forever is not None and set(forever['days']).issuperset(event.days):
+            # Already in the schedule for good.
+            self.counts['duplicates'] += 1
+            return
+        key = (event.time.hour, event.time.minute, until)
+        entry = entries.get(key)
+        if entry is None:
+            entries[key] = meeting.as_dict()
+            self.schedule.append(entries[key])
+            self.events[id(entries[key])] = 1
+            self.counts['added'] += 1
+            return
+        days = set(entry['days'])
+        if days.issuperset(event.days):
+            self.counts['duplicates'] += 1
+            return
+        if id(entry) not in self.events:
+            self.original[id(entry)] = entry['days']
+        self.events[id(entry)] = self.events.get(id(entry), 0) + 1
+        entry['days'] = sorted(days.union(event.days))
+        self.counts['merged'] += 1
+
+    def drop_overlaps(self):
+        """Leave out what the import added or changed that overlaps with other meetings, like the config tool
+        refuses it: new entries are removed, and the weekdays of existing ones are restored. The schedule as it
+        was, then the imported entries in order, have priority. Overlaps that were already there are kept, and
+        meetings that are over don't count."""
+        while True:
+            indexes = [k for k, entry in enumerate(self.schedule) if entry['time'] is not None and entry['days']
+                       and not Meeting.from_dict(entry).is_over(self.now)]
+            meetings = [Meeting.from_dict(self.schedule[k]) for k in indexes]
+            dropped = set()
+            for a, b in find_overlaps(meetings):
+                a, b = indexes[a], indexes[b]
+                if a in dropped or b in dropped:
+                    continue
+                for k in (b, a):
+                    if id(self.schedule[k]) in self.events:
+                        dropped.add(k)
+                        break
+            if not dropped:
+                return
+            kept = []
+            for k, entry in enumerate(self.schedule):
+                if k not in dropped:
+                    kept.append(entry)
+                    continue
+                events = self.events.pop(id(entry))
+                self.counts['overlaps'] += events
+                if id(entry) in self.original:
+                    entry['days'] = self.original.pop(id(entry))
+                    self.counts['merged'] -= events
+                    kept.append(entry)
+                else:
+                    self.counts['added'] -= 1
+                    self.counts['merged'] -= events - 1
+            self.schedule[:] = kept
+
+
+def import_file(path: str) -> Dict[str, int]:
+    """Import an .ics or .csv file into the schedule. Returns how many events were added, merged into
+    existing meetings (new weekdays), already there, skipped (no time, not weekly or malformed), without meeting ID,
+    over (past or ended recurrences) or left out because they overlap with other meetings."""
+    schedule = [meeting.as_dict() for meeting in Meeting.schedule()]
+    importer = Importer(schedule)
+    with open(path, newline='', encoding='utf-8-sig', errors='replace') as f:
+        if path.lower().endswith(('.ics', '.ical', '.ifb', '.icalendar')):
+            for props in ics_events(f):
+                importer.add(ics_event, props)
+        else:
+            for row in csv_rows(f):
+                importer.add(csv_event, row)
+    importer.drop_overlaps()
+    if importer.counts['added'] or importer.counts['merged']:
+        Meeting.save_schedule(schedule)
+    return importer.counts
+
+
+def main(path: str) -> int:
+    try:
+        counts = import_file(path)
+    except (OSError, UnicodeError, csv.Error) as e:
+        print(f'Could not import {path}: {e}')
+        return 1
+    print(f'{counts["events"]} event(s) read: {counts["added"]} meeting(s) added, {counts["merged"]} '
+          f'updated with new weekdays, {counts["duplicates"]} already in your schedule.')
+    if counts['skipped'] or counts['no_id'] or counts['past']:
+        print(f'Skipped {counts["no_id"]} event(s) without a meeting ID, {counts["past"]} past or ended event(s), '
+              f'and {counts["skipped"]} all-day, cancelled, one-off or non-weekly event(s).')
+    if counts['overlaps']:
+        print(f'Left out {counts["overlaps"]} event(s) that overlap with other meetings of your schedule. '
+              f'You can add them with "autopilot -c" after making room.')
+    return 0
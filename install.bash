@@ -14,8 +14,8 @@ else
   mkdir ~/Library/com.UmActually.Autopilot ~/Library/com.UmActually.Autopilot/Resources
 fi
 
-echo -e "\nInstalling PyAutoGUI (Python module for automation)\n"
-python3 -m pip install pyautogui
+echo -e "\nInstalling PyAutoGUI (Python module for automation) & NumPy\n"
+python3 -m pip install pyautogui numpy
 echo
 
 echo -e "\nCopying source files to ~/Library/com.UmActually.Autopilot"
@@ -0,0 +1,172 @@
+from typing import Any, Callable, Dict, Optional
+import threading
+
+from model import Config, Meeting
+from screen import Element, Locator
+from tracing import span
+from utils import pag
+import utils
+
+
+# Screen conditions: the orange "New Meeting" button of the home window, the blue button of the
+# video preview, and the red leave button, in fullscreen and in windowed mode. The positions are those
+# of a 1440x900 screen; on others, the elements are located the first time (see screen.Locator).
+locator = Locator([Element('home', 122, 276, (239, 124, 65)),
+                   Element('preview', 904, 671, (50, 112, 229)),
+                   Element('fullscreen', 1372, 872, (169, 53, 47)),
+                   Element('windowed', 1421, 784, (169, 53, 47))])
+home = locator.condition('home')
+preview = locator.condition('preview')
+fullscreen = locator.condition('fullscreen')
+windowed = locator.condition('windowed')
+
+
+def window_is(*words: str) -> Callable[[], bool]:
+    """Condition: the title of Zoom's front window contains one of the words."""
+    return lambda: any(word in utils.front_window('zoom.us') for word in words)
+
+
+def window_is_not(*words: str) -> Callable[[], bool]:
+    condition = window_is(*words)
+    return lambda: not condition()
+
+
+class Step:
+    """A state of the join. On entering it, the action is done, and then the step waits for one of its
+    conditions. The one that matched decides the next step (or the default). If none match within the timeout,
+    the action is retried; once the retries run out, the join moves to on_timeout, or fails if that is None.
+    A step without conditions moves on to the default right after its action."""
+    def __init__(self, action: Callable[[], Optional[str]], conditions: Optional[Dict[str, Any]] = None,
+                 timeout=5., retries=0, then: Optional[Dict[str, str]] = None,
+                 default: Optional[str] = None, on_timeout: Optional[str] = None):
+        self.action = action
+        self.conditions = conditions or {}
+        self.timeout = timeout
+        self.retries = retries
+        self.then = then or {}
+        self.default = default
+        self.on_timeout = on_timeout
+
+
+class JoinMachine:
+    """Runs the steps from the first one until reaching a state that is not a step (e.g. "done").
+    Every step is traced, and the total latency is kept."""
+    def __init__(self, steps: Dict[str, Step], first: str):
+        self.steps = steps
+        self.first = first
+        self.latency = 0.
+        self.failed: Optional[str] = None
+
+    def run(self) -> Optional[str]:
+        """Returns the final state, or None if a step timed out with nowhere to go (see failed)."""
+        start = utils.clock.monotonic()
+        state = self.first
+        with span('join'):
+            while state in self.steps:
+                step = self.steps[state]
+                with span(state):
+                    outcome = jump = None
+                    for _ in range(step.retries + 1):
+                        # An action may also cut the step short by returning the state to go to.
+                        jump = step.action()
+                        if jump is not None:
+                            break
+                        if not step.conditions:
+                            outcome = ''
+                            break
+                        outcome = utils.wait_for(step.conditions, step.timeout)
+                        if outcome is not None:
+                            break
+                if jump is not None:
+                    state = jump
+                elif outcome is None:
+                    if step.on_timeout is None:
+                        self.failed = state
+                        state = None
+                        break
+                    state = step.on_timeout
+                else:
+                    state = step.then.get(outcome, step.default)
+        self.latency = utils.clock.monotonic() - start
+        return state
+
+
+def nothing():
+    pass
+
+
+class StubOpener:
+    """Stand-in for utils.open_url that records the URLs instead of opening them."""
+    def __init__(self, works=True):
+        self.works = works
+        self.urls = []
+
+    def __call__(self, url: str) -> bool:
+        self.urls.append(url)
+        return self.works
+
+
+# Opens zoommtg:// links. Swap it for a StubOpener to test the URL join without Zoom.
+opener: Callable[[str], bool] = utils.open_url
+
+
+def zoom_steps(meeting: Meeting, config: Config, test=False,
+               prelaunch: Optional[threading.Thread] = None) -> Dict[str, Step]:
+    """The join, starting at "url" (opening a zoommtg:// link, which needs no typing and no pixel polling),
+    or at "launch" (through Zoom's interface). The URL join falls back to the interface if the link can't be
+    opened or Zoom doesn't join in time. Ends at "done", or at "test" in test mode (right before pressing
+    enter). If Zoom is already being launched by the prelaunch thread, the first step waits for it."""
+    # The leave buttons share their color, so they are only found at their usual positions (see screen.Locator).
+    # Elsewhere, the title of the meeting window tells that Zoom joined.
+    in_meeting = {'fullscreen': fullscreen, 'windowed': windowed, 'meeting': window_is('Zoom Meeting')}
+    joined = dict(in_meeting, preview=preview) if config.video else in_meeting
+
+    def wait_prelaunch():
+        if prelaunch is not None:
+            prelaunch.join()
+
+    def launch():
+        wait_prelaunch()
+        utils.open_app('zoom.us')
+
+    def open_url():
+        wait_prelaunch()
+        if not opener(meeting.join_url()):
+            return 'launch'
+
+    def close_menu():
+        # Switch to the home window, close it, and come back if the meeting was fullscreen.
+        is_fullscreen = fullscreen.all()
+        utils.hotkey('command', '`', wait=0)
+        utils.wait_for({'home': window_is_not('Meeting')}, 1)
+        utils.hotkey('command', 'w', wait=0)
+        if is_fullscreen:
+            utils.hotkey('command', '`', wait=0)
+
+    def click_join():
+        # The join button extends to the left of the probed point.
+        x, y = locator.position('preview')
+        pag.click(x=x - 104, y=y - 1)
+
+    def go_fullscreen():
+        if not fullscreen.all():
+            utils.hotkey('command', 'shift', 'f', wait=0)
+
+    return dict(
+        url=Step(open_url, dict(meeting=window_is('Zoom Meeting'), preview=window_is('Video Preview')),
+                 timeout=30, then=dict(preview='preview'), default='close_menu', on_timeout='launch'),
+        # If the home window isn't found where expected, carry on like before: command+j still works.
+        launch=Step(launch, dict(home=home),
+                    timeout=8, default='dialog', on_timeout='dialog'),
+        dialog=Step(lambda: utils.hotkey('command', 'j', wait=0), dict(dialog=window_is('Join')),
+                    timeout=2, retries=1, default='type_id', on_timeout='type_id'),
+        type_id=Step(lambda: pag.typewrite(str(meeting.zoom)), default='test' if test else 'enter'),
+        enter=Step(lambda: pag.press('enter'), joined,
+                   timeout=60, then=dict(preview='preview'), default='settle'),
+        preview=Step(click_join, in_meeting,
+                     timeout=10, retries=1, default='settle'),
+        # Zoom may go fullscreen by itself shortly after joining.
+        settle=Step(nothing, dict(fullscreen=fullscreen),
+                    timeout=3, default='close_menu', on_timeout='close_menu'),
+        close_menu=Step(close_menu if config.close_menu else nothing, default='fullscreen'),
+        fullscreen=Step(go_fullscreen if config.fullscreen else nothing, default='done'))
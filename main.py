@@ -1,13 +1,17 @@
 if __name__ != '__main__':
     exit(1)
 
-from time import sleep
+from typing import Optional, Callable, Dict, List
 import os
 import getpass
-
-import pyautogui as pag
-
-from model import Config
+import datetime
+import threading
+import atexit
+
+from model import Config, Meeting, Agenda, History
+from wake import Waker, PmsetScheduler, GUIScheduler, wait_for_wake
+from tracing import tracer, span
+from utils import pag
 import parsing
 import utils
 
@@ -16,6 +20,13 @@ pag.PAUSE = 0.5
 args = parsing.args
 config = Config()
 
+if config.get('sqlite', False):
+    from store import Store
+    Meeting.store = Store()
+
+if args.trace or args.trace_file is not None:
+    tracer.start(os.path.abspath(args.trace_file) if args.trace_file else utils.full_path('Resources/trace.jsonl'))
+
 
 def _print(value):
     if not args.quiet:
@@ -27,101 +38,170 @@ if args.config:
     configtool.launch(config)
     exit()
 
+if args.import_file is not None:
+    import importer
+    exit(importer.main(args.import_file))
+
+if args.server:
+    import server
+    server.serve()
+    exit()
+
 
-meeting = parsing.figure_out_meeting_info(config)
-test_mode = args.test or (meeting.name == 'Autopilot Test')
+meeting = None if args.daemon else parsing.figure_out_meeting_info(config)
 
 
-def wait_for_meeting():
+# Past this point, a meeting will be joined. NumPy (and the follow-up work: asyncio, smtplib) is imported only now.
+from postjoin import Pipeline, Notifier
+import asyncio
+import joining
+import screen
+
+# Zoom launching in the background, see wait_for_meeting.
+prelaunch: Optional[threading.Thread] = None
+
+
+def wait_for_meeting(meeting: Meeting, interrupt: Optional[Callable[[], bool]] = None) -> bool:
     """Wait until the meeting time, and wake the computer.
     The display can be either asleep or awake during this function.
-    This step is omitted if Autopilot is invoked in "right now" mode."""
-    if config.ask_pass:
-        utils.sudo('pmset', 'schedule', 'wake', meeting.wake, password=user_pass)
-    else:
-        utils.change_wake_time(meeting.time)
+    This step is omitted if Autopilot is invoked in "right now" mode.
+    If the interrupt function returns True before the last minute, stop waiting and return False.
+    Also returns False if the computer slept past the late-to-class threshold of the meeting."""
+    with span('schedule_wake'):
+        waker.ensure(meeting)
     _print((f'"{meeting.name}" found in schedule. ' * (meeting.name is not None))
            + f'Wake time: {meeting.wake}')
 
     _print(f'Autopilot ready. You can now put your mac to sleep. To cancel, use ctrl+C.')
 
-    sooner = meeting.time.subtracting_minute()
-    is_awake = True
-
     _print('Waiting for meeting...')
 
-    while utils.time().hour != sooner.hour:
-        sleep(config.interval)
-    while utils.time().minute != sooner.minute:
-        if utils.time().minute == meeting.time.minute:
-            is_awake = False
-            break
-        sleep(config.interval)
-
-    if is_awake:
+    def announce():
         _print('One minute left...')
         utils.run('osascript', '-e',
                   'display notification "Zoom meeting is about to start." with title "Autopilot"')
-        dx = meeting.time.as_dt_time(full=True) - utils.time()
-        sleep(dx.seconds - 2)
-        if config.ask_pass:
-            utils.hotkey('command', 'ctrlleft', 'q')
-        sleep(1)
 
+    def lock():
+        utils.hotkey('command', 'ctrlleft', 'q')
+
+    # The computer may be put to sleep, and woken up for the meeting, in the middle of a nap: naps are kept
+    # to the sleep interval of the config, so the wait doesn't outlast the wake by more than that.
+    alarm = wait_for_wake(meeting, utils.clock, interrupt, announce, lock if config.ask_pass else None,
+                          config.interval)
+    if alarm.interrupted:
+        _print('Schedule changed, looking for the next meeting...')
+        return False
+
+    _print(f'Wakeups while waiting: {alarm.wakeups} ({alarm.wakeups_per_hour():.1f}/hour), '
+           f'clock jumps: {alarm.jumps}')
+    if not alarm.on_time and utils.time() - meeting.wake_time() > datetime.timedelta(minutes=config.threshold):
+        # The computer slept through the meeting (e.g. with the lid closed): it is long over.
+        _print(f'Missed the meeting of {meeting.wake}, the computer was asleep.')
+        return False
     _print(f'Waking computer: {utils.time_string()}')
-    utils.run('caffeinate', '-u', '-t', '1')
-    if config.ask_pass:
-        utils.run('osascript', '-e', 'tell application "System Events" to key code 124')
-        utils.type_password(user_pass)
-    sleep(2)
+    with span('wake'):
+        # Zoom launches in the background while the computer wakes up and is unlocked. The join
+        # then waits for the home window to show up, instead of a fixed time after unlocking.
+        global prelaunch
+        prelaunch = threading.Thread(target=utils.open_app, args=('zoom.us',), daemon=True)
+        prelaunch.start()
+        utils.run('caffeinate', '-u', '-t', '1')
+        if config.ask_pass:
+            utils.run('osascript', '-e', 'tell application "System Events" to key code 124')
+            utils.type_password(user_pass)
+    return True
 
 
-def enter_meeting():
+def enter_meeting(meeting: Meeting) -> bool:
     """Once everything's ready, open Zoom, enter the meeting.
-    With the default config, join audio and go fullscreen."""
-    utils.open_file('Resources/recent.json', meeting.as_dict())
+    With the default config, join audio and go fullscreen.
+    Returns False if the meeting was not joined (in test mode, or if Zoom didn't respond)."""
     if meeting.is_right_now and meeting.name is not None:
         _print(f'Joining "{meeting.name}": {utils.time_string()}')
     else:
         _print(f'Opening zoom: {utils.time_string()}')
 
-    utils.open_app('zoom.us')
-    utils.wait_until_color(122, 276, 239, 124, 65, timeout=8)
-    utils.hotkey('command', 'j', wait=0.5)
-    pag.typewrite(str(meeting.zoom))
-    sleep(0.3)
-
-    if test_mode:
+    global prelaunch
+    test = args.test or meeting.name == 'Autopilot Test'
+    # The link joins right away, so test mode (which stops before joining) goes through the interface.
+    machine = joining.JoinMachine(joining.zoom_steps(meeting, config, test=test, prelaunch=prelaunch),
+                                  'launch' if test else 'url')
+    prelaunch = None
+    # Every step waits for Zoom to be ready, rather than for a fixed time, so keystrokes need little pause.
+    pag.PAUSE = 0.05
+    try:
+        state = machine.run()
+    finally:
+        pag.PAUSE = 0.5
+
+    if state == 'test':
         _print('Program was run in test mode. Exiting...')
-        exit()
-    pag.press('enter')
-
-    if config.video:
-        while not (utils.color_match(1372, 872, 169, 53, 47) or utils.color_match(1421, 784, 169, 53, 47)):
-            found = utils.wait_until_color(904, 671, 50, 112, 229, timeout=5)
-            if found:
-                pag.click(x=800, y=670)
-                break
-
-    sleep(3)
-
-    is_fullscreen = utils.color_match(1372, 872, 169, 53, 47)
-    if config.close_menu:
-        utils.hotkey('command', '`')
-        utils.hotkey('command', 'w')
-        if is_fullscreen:
-            utils.hotkey('command', '`')
-    if config.fullscreen and not is_fullscreen:
-        utils.hotkey('command', 'shift', 'f')
-
-
-def notify_by_email():
-    """This is not implemented yet."""
-    import yagmail
-    # noinspection PyUnboundLocalVariable
-    with yagmail.SMTP(email, email_pass) as yag:
-        # noinspection PyUnboundLocalVariable
-        yag.send(dest, 'Ha Iniciado El Zoom', 'Atte. Autopilot')
+        return False
+    if state is None:
+        _print(f'Could not join the meeting: step "{machine.failed}" timed out.')
+        return False
+    _print(f'Joined in {machine.latency:.1f} seconds.')
+    return True
+
+
+def remove_screenshots():
+    """Remove the screenshots PyAutoGUI may leave in the working dir."""
+    with os.scandir() as entries:
+        for entry in entries:
+            if 'screenshot' in entry.name and entry.is_file():
+                os.remove(entry.path)
+
+
+def report(batches: List[Dict[str, Optional[BaseException]]]):
+    """Print the follow-up tasks that failed or timed out."""
+    for results in batches:
+        for name, error in results.items():
+            if isinstance(error, asyncio.TimeoutError):
+                _print(f'Follow-up task "{name}" timed out.')
+            elif error is not None:
+                _print(f'Follow-up task "{name}" failed: {error!r}')
+
+
+def join(meeting: Meeting):
+    """Enter the meeting and start the follow-up work (history, notification and cleanup) in the background.
+    Except in daemon mode, it is waited for before exiting. In daemon mode, it doesn't hold up the next wait."""
+    with span('enter_meeting'):
+        if not enter_meeting(meeting):
+            return
+
+    tasks = dict(history=lambda: History().add(meeting))
+    if notifier is not None:
+        tasks['notify'] = lambda: notifier.send(dest, 'Ha Iniciado El Zoom', 'Atte. Autopilot')
+    # Screen captures only leave files behind when falling back to PyAutoGUI.
+    if config.remove_ss and isinstance(screen.backend, screen.PyAutoGUIBackend):
+        tasks['cleanup'] = remove_screenshots
+    pipeline.submit(tasks)
+
+    if not args.daemon:
+        with span('follow_up'):
+            report(pipeline.drain(pipeline.timeout + 1))
+        if notifier is not None:
+            notifier.close()
+    _print(f'Done! {utils.time_string()}\n')
+
+
+def run_daemon():
+    """Join every meeting of the schedule, one after the other, until stopped.
+    Edits to schedule.json are picked up while waiting."""
+    agenda = Agenda()
+    _print('Autopilot daemon running. To stop it, use ctrl+C.')
+    while True:
+        meeting = agenda.pop(config.threshold)
+        if meeting is None:
+            # Empty schedule, check again when it changes.
+            utils.Alarm(utils.time() + datetime.timedelta(hours=1), max_nap=60.).wait(agenda.stale)
+            continue
+        # Report the follow-up work of the previous join, if it ended.
+        report(pipeline.drain(0))
+        with span('wait_for_meeting'):
+            ready = wait_for_meeting(meeting, agenda.stale)
+        if ready:
+            join(meeting)
 
 
 try:
@@ -129,26 +209,35 @@ try:
         utils.open_file(f'/Users/{getpass.getuser()}/.SuperSecretTokens/autopilot.txt').split('\n')
     authentic = True
 except FileNotFoundError:
-    if config.ask_pass and not meeting.is_right_now:
+    user_pass = None
+    if config.ask_pass and (args.daemon or not meeting.is_right_now):
         user_pass = getpass.getpass()
     authentic = False
 
+# The SMTP connection is kept open between the joins of the daemon mode. The server can be changed
+# (e.g. to a local one, for testing) with the smtp_host and smtp_port options of userconfig.json.
+notifier = Notifier(email, email_pass, config.get('smtp_host', 'smtp.gmail.com'), config.get('smtp_port', 465)) \
+    if authentic else None
+pipeline = Pipeline()
+# With the password, the wakes of the whole week are scheduled at once (pmset). Otherwise, in System Preferences.
+waker = Waker(PmsetScheduler(user_pass) if config.ask_pass else GUIScheduler())
 
-# Function execution
-
-
-if not meeting.is_right_now:
-    wait_for_meeting()
 
-enter_meeting()
+# Function execution
 
-if authentic:
-    notify_by_email()
 
-if config.remove_ss:
-    for file in os.listdir():
-        if 'screenshot' in file:
-            os.remove(file)
+if args.daemon:
+    if user_pass is not None:
+        # The wakes of every week go through a single sudo worker, see runner.py.
+        from runner import Runner
+        utils.sudo_runner = Runner(user_pass)
+        atexit.register(lambda: _print('\n' + utils.sudo_runner.summary()))
+    run_daemon()
 
+if not meeting.is_right_now:
+    with span('wait_for_meeting'):
+        ready = wait_for_meeting(meeting)
+    if not ready:
+        exit(1)
 
-_print(f'Done! {utils.time_string()}\n')
+join(meeting)
@@ -1,28 +1,75 @@
 from __future__ import annotations
-from typing import Any, Optional, Union, Tuple, List
+from typing import Any, Optional, Union, Tuple, List, Dict, Iterator
+from contextlib import contextmanager
+from bisect import bisect_left, bisect_right
+from urllib.parse import urlencode
+import os
+import json
 import datetime
+import heapq
 
 import utils
 
 
 class Config:
-    """Config class that wraps the userconfig JSON."""
+    """Config class that wraps the userconfig JSON. Every option change is saved right away,
+    unless it is made inside a batch (see Config.batch)."""
+    _internal = ['path', 'dict', 'batching', 'dirty']
+
     def __init__(self):
         self.path = 'Resources/userconfig.json'
-        self.dict = utils.open_file(self.path)
+        self.dict = dict(utils.open_file(self.path))
+        self.batching = 0
+        self.dirty = False
 
     def save(self):
-        utils.open_file(self.path, self.dict)
+        utils.open_file(self.path, dict(self.dict))
+        self.dirty = False
+
+    @contextmanager
+    def batch(self) -> Iterator[Config]:
+        """Group option changes into a transaction: userconfig.json is written once, when the
+        outermost batch ends, and only if something changed. On an exception, the changes of the batch
+        are discarded; those of the batches around it are kept, and still written when they end."""
+        backup, dirty = dict(self.dict), self.dirty
+        self.batching += 1
+        try:
+            yield self
+        except BaseException:
+            self.dict = backup
+            self.dirty = dirty
+            raise
+        finally:
+            self.batching -= 1
+        if not self.batching and self.dirty:
+            self.save()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """An option that may not be in userconfig.json (e.g. a hidden one), with its default."""
+        return self.dict.get(key, default)
 
     def __getattr__(self, item: str) -> Any:
         return self.dict[item]
 
     def __setattr__(self, key: str, value: Any):
-        if key in ['path', 'dict']:
+        if key in self._internal:
             object.__setattr__(self, key, value)
             return
+        if key in self.dict and self.dict[key] == value:
+            return
         self.dict[key] = value
-        self.save()
+        self.dirty = True
+        if not self.batching:
+            self.save()
+
+
+day_minutes = 24 * 60
+week_minutes = 7 * day_minutes
+
+
+def minute_of_week(date: datetime.datetime) -> int:
+    """Minutes since Monday 00:00 for a datetime, seconds are truncated."""
+    return date.weekday() * day_minutes + date.hour * 60 + date.minute
 
 
 class Time:
@@ -36,7 +83,7 @@ class Time:
     def as_dt_time(self, full=False) -> Union[datetime.time, datetime.datetime]:
         resp = datetime.time(self.hour, self.minute)
         if full:
-            resp = datetime.datetime.combine(datetime.date.today(), resp)
+            resp = datetime.datetime.combine(utils.time().date(), resp)
         return resp
 
     def as_12_hour(self) -> Tuple[int, int, bool]:
@@ -51,6 +98,10 @@ class Time:
             return self.__class__(self.hour - 1, 59)
         return self.__class__(self.hour, self.minute - 1)
 
+    def minute_of_week(self, day: int) -> int:
+        """Minutes since Monday 00:00 for this time on the given weekday (1-7, 1 is Monday)."""
+        return (day - 1) * day_minutes + self.hour * 60 + self.minute
+
     def sorting_key(self) -> float:
         """Assigns a "non-discrete" value for the time
         to help sort the schedule."""
@@ -76,17 +127,122 @@ class Time:
         return f'{self.hour}:{"0" * (self.minute < 10)}{self.minute}'
 
 
+def find_overlaps(meetings: List[Meeting]) -> List[Tuple[int, int]]:
+    """Every pair of meetings (as indexes of the list) that overlap at some point of the week.
+    Meetings without a duration occupy their starting minute only. The occurrences are swept in
+    order of start, keeping a heap of the ones still going on: O(n log n), plus the pairs found."""
+    intervals = []
+    for k, meeting in enumerate(meetings):
+        length = meeting.duration or 1
+        for day in set(meeting.days):
+            start = meeting.time.minute_of_week(day)
+            end = start + length
+            if end > week_minutes:
+                # Sunday night into Monday morning.
+                intervals.append((0, end - week_minutes, k))
+                end = week_minutes
+            intervals.append((start, end, k))
+    intervals.sort()
+
+    pairs = set()
+    active: List[Tuple[int, int]] = []
+    for start, end, k in intervals:
+        while active and active[0][0] <= start:
+            heapq.heappop(active)
+        for _, j in active:
+            if j != k:
+                pairs.add((min(j, k), max(j, k)))
+        heapq.heappush(active, (end, k))
+    return sorted(pairs)
+
+
+class Timeline:
+    """Minute-of-week index of a schedule. Every (meeting, weekday) pair is an occurrence, sorted once
+    by its minute of the week. Lookups are then a binary search, wrapping around at the end of the week.
+    Meetings that are over (see Meeting.until) are left out; expires is when the next one will be."""
+    def __init__(self, schedule: List[Meeting]):
+        now = utils.time()
+        current = [(k, meeting) for k, meeting in enumerate(schedule) if not meeting.is_over(now)]
+        self.expires = min((meeting.until for _, meeting in current if meeting.until is not None), default=None)
+        # Ties are broken by position in the schedule, like the stable sort used to do.
+        occurrences = sorted(
+            (meeting.time.minute_of_week(day), k, meeting)
+            for k, meeting in current for day in set(meeting.days))
+        self.minutes = [o[0] for o in occurrences]
+        self.meetings = [o[2] for o in occurrences]
+        self.by_zoom: Dict[int, Tuple[List[int], List[Meeting]]] = {}
+        for minute, _, meeting in occurrences:
+            minutes, meetings = self.by_zoom.setdefault(meeting.zoom, ([], []))
+            minutes.append(minute)
+            meetings.append(meeting)
+
+    def _lists(self, zoom: Optional[int]) -> Tuple[List[int], List[Meeting]]:
+        if zoom is None:
+            return self.minutes, self.meetings
+        return self.by_zoom.get(zoom, ([], []))
+
+    def after(self, minute: int, zoom: Optional[int] = None) -> Optional[Tuple[int, Meeting]]:
+        """First occurrence strictly after the given minute of the week (with the given zoom ID, if any).
+        Returns the minutes left until it, and the meeting."""
+        minutes, meetings = self._lists(zoom)
+        if not minutes:
+            return
+        k = bisect_right(minutes, minute)
+        if k == len(minutes):
+            return minutes[0] + week_minutes - minute, meetings[0]
+        return minutes[k] - minute, meetings[k]
+
+    def before(self, minute: int, zoom: Optional[int] = None) -> Optional[Meeting]:
+        """Last occurrence at or before the given minute of the week, as long as it is on the same day."""
+        minutes, meetings = self._lists(zoom)
+        k = bisect_right(minutes, minute) - 1
+        if k < 0 or minutes[k] < minute - minute % day_minutes:
+            return
+        # Among meetings at the same time, prefer the first one in the schedule.
+        return meetings[bisect_left(minutes, minutes[k])]
+
+    def of_day(self, day: int) -> List[Meeting]:
+        """Meetings of a weekday (1-7, 1 is Monday), sorted by time."""
+        start = (day - 1) * day_minutes
+        return self.meetings[bisect_left(self.minutes, start):bisect_left(self.minutes, start + day_minutes)]
+
+
+class StoreTimeline:
+    """The lookups of Timeline, as queries of the store."""
+    def __init__(self, store: Any):
+        self.store = store
+
+    def after(self, minute: int, zoom: Optional[int] = None) -> Optional[Tuple[int, Meeting]]:
+        found = self.store.after(minute, zoom)
+        return None if found is None else (found[0], Meeting.from_dict(found[1]))
+
+    def before(self, minute: int, zoom: Optional[int] = None) -> Optional[Meeting]:
+        found = self.store.before(minute, zoom)
+        return None if found is None else Meeting.from_dict(found)
+
+
 class Meeting:
     """This class represents a meeting. It also has functions to translate to and from dicts
     for storing in schedule.json, and to find the next meeting in the user's schedule."""
-    _schedule = None
+    schedule_path = 'Resources/schedule.json'
+    # The SQLite store (see store.py), if enabled. Otherwise, the schedule is read from schedule.json.
+    store: Any = None
+    _schedule: Optional[List[Meeting]] = None
+    _raw: Any = None
+    _timeline: Optional[Timeline] = None
 
     def __init__(self, time: Optional[Time] = None, zoom: Optional[int] = None,
-                 name: Optional[str] = None, days: Optional[List[int]] = None, on_sched=False):
+                 name: Optional[str] = None, days: Optional[List[int]] = None, on_sched=False,
+                 duration: Optional[int] = None, pwd: Optional[str] = None,
+                 until: Optional[datetime.datetime] = None):
         self.time = time
         self.zoom = zoom
+        self.pwd = pwd
         self.name = name
         self.days = days
+        self.duration = duration
+        # Start of the last occurrence, for meetings that end (e.g. imported courses). None if they don't.
+        self.until = until
         self.wake = None
         self.is_right_now = time is None
         self.is_on_sched = on_sched
@@ -109,74 +265,126 @@ class Meeting:
             self.wake = f'{date.month}/{date.day}/{date.year} ' \
                         f'{self.time}:00'
 
+    def wake_time(self) -> Optional[datetime.datetime]:
+        """The wake date & time as a datetime object."""
+        if self.wake is None:
+            return
+        return datetime.datetime.strptime(self.wake, '%m/%d/%Y %H:%M:%S')
+
+    def is_over(self, now: Optional[datetime.datetime] = None) -> bool:
+        """Whether the last occurrence of the meeting already started."""
+        return self.until is not None and self.until < (now or utils.time())
+
     def fmt_weekdays(self) -> str:
         names = ['Sun', 'Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
         return ', '.join([names[d] for d in self.days])
 
     def as_dict(self) -> dict:
         time = None if self.time is None else [self.time.hour, self.time.minute]
-        return dict(time=time, zoom=self.zoom, name=self.name, days=self.days, on_sched=self.is_on_sched)
+        until = None if self.until is None else self.until.isoformat(timespec='minutes')
+        return dict(time=time, zoom=self.zoom, name=self.name, days=self.days, on_sched=self.is_on_sched,
+                    duration=self.duration, pwd=self.pwd, until=until)
 
     @classmethod
     def from_dict(cls, meeting: dict) -> Meeting:
         time = None if meeting['time'] is None else Time(*meeting['time'])
-        return cls(time, meeting['zoom'], meeting['name'], meeting['days'], meeting['on_sched'])
+        until = meeting.get('until')
+        return cls(time, meeting['zoom'], meeting['name'], meeting['days'], meeting['on_sched'],
+                   meeting.get('duration'), meeting.get('pwd'),
+                   None if until is None else datetime.datetime.fromisoformat(until))
 
     @classmethod
-    def schedule(cls):
-        if cls._schedule is None:
-            cls._schedule = list(map(
-                cls.from_dict, utils.open_file('Resources/schedule.json')))
+    def schedule(cls) -> List[Meeting]:
+        """The user's schedule. It is parsed again only when schedule.json (or the store) changes."""
+        if cls.store is not None:
+            version = cls.store.version()
+            if version != cls._raw:
+                cls._schedule = [cls.from_dict(meeting) for _, meeting in cls.store.all()]
+                cls._raw = version
+                cls._timeline = None
+            return cls._schedule
+        raw = utils.open_file(cls.schedule_path)
+        if raw is not cls._raw:
+            cls._schedule = list(map(cls.from_dict, raw))
+            cls._raw = raw
+            cls._timeline = None
         return cls._schedule
 
+    @classmethod
+    def save_schedule(cls, schedule: List[dict]):
+        """Replace the whole schedule, in the store or in schedule.json."""
+        if cls.store is not None:
+            cls.store.replace(schedule)
+            return
+        utils.open_file(cls.schedule_path, schedule)
+
+    @classmethod
+    def timeline(cls) -> Timeline:
+        """Minute-of-week index of the schedule, rebuilt along with it, and when a meeting of it is over."""
+        schedule = cls.schedule()
+        if cls._timeline is None or cls._timeline.expires is not None and cls._timeline.expires < utils.time():
+            cls._timeline = Timeline(schedule)
+        return cls._timeline
+
     @classmethod
     def schedule_of_day(cls, day: int, reverse=False) -> List[Meeting]:
-        day_schedule = []
-        for meeting in cls.schedule():
-            if day in meeting.days:
-                day_schedule.append(meeting)
-        day_schedule.sort(key=lambda m: m.time.sorting_key(), reverse=reverse)
+        if cls.store is not None:
+            return list(map(cls.from_dict, cls.store.of_day(day, reverse)))
+        day_schedule = cls.timeline().of_day(day)
+        if reverse:
+            day_schedule.reverse()
         return day_schedule
 
     @classmethod
     def schedule_lookup(
             cls, target_meet: Optional[Meeting] = None, reverse=False) -> Optional[Meeting]:
-        """Skim through the schedule in order, starting from the present, until desired target(s) satisfied.
-        If the target meeting is None, return whichever meeting is found first. If a target meeting is passed,
-        the returned meeting must have the same zoom ID.
+        """Find the closest meeting in the schedule, starting from the present. If the target meeting is None,
+        return whichever meeting is found first. If a target meeting is passed, the returned meeting must have
+        the same zoom ID.
 
-        When reverse is False, go forward in time. Only look for meetings with a time greater than the target time
-        (future), in case of the starting day. After looking up in the current weekday, set the target time to zero
-        to accept any meeting from the days after. The algorithm gives up once the seven weekdays are exhausted.
+        When reverse is False, go forward in time. Only meetings with a time greater than the current one are
+        accepted, wrapping around to the start of the next week. The wake date of the meeting is assigned.
 
-        When reverse is True, go backward in time. Only look for meetings of the same day with a time lower than the
-        target time (past)."""
-        look_for_meet = target_meet is not None
+        When reverse is True, go backward in time. Only look for meetings of the same day with a time lower than
+        (or equal to) the current time (past)."""
+        zoom = None if target_meet is None else target_meet.zoom
         date = utils.time()
-        target_time = date.time()
-        weekday = date.weekday() + 1
-
-        for _ in range(7):
-            day_sched = cls.schedule_of_day(weekday, reverse=reverse)
-
-            for meeting in day_sched:
-                # IF the meeting has a GREATER TIME (or rather LESSER if in reverse), AND
-                # in case there is a MEETING target, ALSO MAKE SURE it is satisfied.
-                if (meeting.time.as_dt_time() > target_time) != reverse and \
-                        (meeting == target_meet or not look_for_meet):
-                    if look_for_meet:
-                        meeting = target_meet
-                    if reverse:
-                        meeting.is_right_now = True
-                    else:
-                        meeting.wake = f'{date.month}/{date.day}/{date.year} {meeting.time}:00'
-                    return meeting
-
-            if reverse:
-                return  # Give up
-            target_time = datetime.time()
-            date += datetime.timedelta(days=1)
-            weekday = (weekday % 7) + 1
+        now = minute_of_week(date)
+        # With the store, the lookups are indexed queries. Otherwise, binary searches of the timeline.
+        timeline = cls.timeline() if cls.store is None else StoreTimeline(cls.store)
+
+        if reverse:
+            meeting = timeline.before(now, zoom)
+            if meeting is None:
+                return
+            if target_meet is not None:
+                meeting = target_meet
+            meeting.is_right_now = True
+            return meeting
+
+        found = timeline.after(now, zoom)
+        if found is None:
+            return
+        delta, meeting = found
+        if target_meet is not None:
+            meeting = target_meet
+        meeting.is_right_now = False
+        date += datetime.timedelta(minutes=delta)
+        meeting.wake = f'{date.month}/{date.day}/{date.year} {meeting.time}:00'
+        return meeting
+
+    @classmethod
+    def closest(cls, threshold: int, late=False) -> Optional[Meeting]:
+        """The meeting to join now: the last one of today, if it started less than threshold minutes ago
+        (or at all, when late), and otherwise the next one. None if there is no such meeting."""
+        last = cls.last()
+        if last is not None:
+            dx = (utils.time() - last.time.as_dt_time(full=True)).seconds // 60
+            if late or dx < threshold:
+                return last
+        elif late:
+            return
+        return cls.next()
 
     @classmethod
     def next(cls) -> Optional[Meeting]:
@@ -188,11 +396,23 @@ class Meeting:
 
     @staticmethod
     def parse_id(zoom='auto', ask=False) -> Optional[int]:
+        return Meeting.parse_link(zoom, ask)[0]
+
+    @staticmethod
+    def parse_link(zoom='auto', ask=False) -> Tuple[Optional[int], Optional[str]]:
+        """Meeting ID and passcode (if the link has one)."""
         if ask:
             zoom = input('Meeting ID? (Number or link) ')
         if zoom == 'auto':
-            return
-        return utils.parse_id(zoom)
+            return None, None
+        return utils.parse_link(zoom)
+
+    def join_url(self) -> str:
+        """URL that makes the Zoom app join the meeting directly."""
+        query = dict(action='join', confno=self.zoom)
+        if self.pwd is not None:
+            query['pwd'] = self.pwd
+        return 'zoommtg://zoom.us/join?' + urlencode(query)
 
     def __eq__(self, other):
         try:
@@ -202,3 +422,138 @@ class Meeting:
 
     def __repr__(self):
         return self.name
+
+
+class Agenda:
+    """Heap-ordered queue of the upcoming occurrences of the schedule, for the daemon mode.
+    Every (meeting, weekday) pair has exactly one occurrence in the heap; once popped, the same
+    occurrence of the following week is pushed back, unless the meeting is over by then (see Meeting.until).
+    The queue is rebuilt whenever schedule.json changes."""
+    def __init__(self):
+        self.schedule: Optional[List[Meeting]] = None
+        self.heap: List[Tuple[datetime.datetime, int, Meeting]] = []
+
+    def stale(self) -> bool:
+        """Whether the schedule changed since the queue was built."""
+        return Meeting.schedule() is not self.schedule
+
+    def refresh(self):
+        """Build the queue with the next occurrence of every meeting, from the present."""
+        timeline = Meeting.timeline()
+        self.schedule = Meeting.schedule()
+        now = utils.time()
+        week_start = now.replace(second=0, microsecond=0) - datetime.timedelta(minutes=minute_of_week(now))
+        self.heap = []
+        for k, (minute, meeting) in enumerate(zip(timeline.minutes, timeline.meetings)):
+            when = week_start + datetime.timedelta(minutes=minute)
+            if when <= now:
+                when += datetime.timedelta(weeks=1)
+            if meeting.until is None or when <= meeting.until:
+                self.heap.append((when, k, meeting))
+        heapq.heapify(self.heap)
+
+    def pop(self, threshold: Optional[int] = None) -> Optional[Meeting]:
+        """The next meeting, with its wake date assigned. None if the schedule is empty (or over). With a threshold,
+        occurrences that started more than threshold minutes ago (e.g. while the computer was asleep, or
+        during a long join) are skipped."""
+        if self.stale():
+            self.refresh()
+        oldest = None if threshold is None else utils.time() - datetime.timedelta(minutes=threshold)
+        while True:
+            if not self.heap:
+                return
+            when, k, meeting = heapq.heappop(self.heap)
+            following = when + datetime.timedelta(weeks=1)
+            if meeting.until is None or following <= meeting.until:
+                heapq.heappush(self.heap, (following, k, meeting))
+            if oldest is None or when >= oldest:
+                break
+        meeting.wake = f'{when.month}/{when.day}/{when.year} {meeting.time}:00'
+        meeting.is_right_now = False
+        return meeting
+
+
+class History:
+    """Log of the joined meetings (Resources/history.jsonl), one JSON line per join. Joins are appended,
+    never rewritten; once the log holds twice the limit, it is compacted to the last limit joins. Loading it
+    builds an index of the latest join of every meeting, by zoom ID and by name, in order of recency."""
+    path = 'Resources/history.jsonl'
+    limit = 100
+
+    def __init__(self):
+        self.lines = 0
+        self.entries: List[dict] = []
+        self.by_zoom: Dict[int, dict] = {}
+        self.by_name: Dict[str, dict] = {}
+        self._order: Optional[List[dict]] = None
+        path = utils.full_path(self.path)
+        if not os.path.exists(path):
+            self.seed()
+            return
+        with open(path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A line left half-written by a crash.
+                    continue
+                self.lines += 1
+                self._index(entry)
+
+    def seed(self):
+        """Start the log with the meeting of recent.json, the single-meeting file it replaces."""
+        try:
+            entry = utils.open_file('Resources/recent.json')
+        except (OSError, ValueError):
+            return
+        if isinstance(entry, dict) and 'zoom' in entry:
+            self.add(Meeting.from_dict(entry))
+
+    def _index(self, entry: dict):
+        self.entries.append(entry)
+        # Re-inserting moves the meeting to the end: dicts keep the order of recency.
+        self.by_zoom.pop(entry['zoom'], None)
+        self.by_zoom[entry['zoom']] = entry
+        if entry.get('name'):
+            self.by_name[entry['name'].lower()] = entry
+        self._order = None
+
+    def add(self, meeting: Meeting):
+        """Append a join of the meeting to the log."""
+        entry = dict(meeting.as_dict(), joined=utils.time().isoformat(timespec='seconds'))
+        self._index(entry)
+        if self.lines + 1 >= 2 * self.limit:
+            self.compact()
+            return
+        with open(utils.full_path(self.path), 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+        self.lines += 1
+
+    def compact(self):
+        """Rewrite the log (atomically) with the last limit joins."""
+        self.entries = self.entries[-self.limit:]
+        utils.open_file(self.path, ''.join(json.dumps(entry) + '\n' for entry in self.entries))
+        self.lines = len(self.entries)
+
+    def recent(self, n=1) -> Optional[Meeting]:
+        """The nth most recently joined meeting (different meetings, 1 is the last one)."""
+        if self._order is None:
+            self._order = list(reversed(self.by_zoom.values()))
+        if not 1 <= n <= len(self._order):
+            return
+        return Meeting.from_dict(self._order[n - 1])
+
+    def named(self, name: str) -> Optional[Meeting]:
+        """The last joined meeting with that name. Without an exact match (ignoring case), the most
+        recent one whose name contains it."""
+        entry = self.by_name.get(name.lower())
+        if entry is None:
+            entry = next((e for e in reversed(self.by_zoom.values())
+                          if e.get('name') and name.lower() in e['name'].lower()), None)
+        return None if entry is None else Meeting.from_dict(entry)
+
+    def lookup(self, query: Union[int, str] = 1) -> Optional[Meeting]:
+        """A number picks the nth most recent meeting, anything else is a name."""
+        if isinstance(query, int) or query.isdigit():
+            return self.recent(int(query))
+        return self.named(query)
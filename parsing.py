@@ -2,7 +2,7 @@ from typing import Callable
 import sys
 import argparse
 
-from model import Meeting, Time, Config
+from model import Meeting, Time, Config, History
 import utils
 
 
@@ -24,7 +24,11 @@ parser.add_argument('-l', '--late', action='store_true',
                     help='join the closest present/past class of your schedule')
 
 parser.add_argument('-r', '--recent', action='store_true',
-                    help='join the most recent autpilot-launched meeting')
+                    help='join the most recent autopilot-launched meeting')
+
+# A separate option: with an optional value, -r would take the meeting time that may follow it (ap -r 8:00 ID).
+parser.add_argument('-p', '--pick', metavar='N|NAME',
+                    help='join the Nth most recent autopilot-launched meeting, or the last one with that name')
 
 parser.add_argument('-t', '--test', action='store_true',
                     help='for testing, stops right before entering meeting')
@@ -32,6 +36,23 @@ parser.add_argument('-t', '--test', action='store_true',
 parser.add_argument('-i', '--input', action='store_true',
                     help='ask for time and ID, rather than using arguments or next class')
 
+parser.add_argument('-d', '--daemon', action='store_true',
+                    help='stay running and join every class of your schedule, in order')
+
+parser.add_argument('--server', action='store_true',
+                    help='keep autopilot loaded in the background, so that commands start faster')
+
+parser.add_argument('--import', dest='import_file', metavar='FILE',
+                    help='add the events of an iCalendar (.ics) or CSV file to your schedule')
+
+parser.add_argument('--trace', action='store_true',
+                    help='record how long each step of joining takes (JSONL, in Resources/trace.jsonl) '
+                         'and print a summary at exit')
+
+# A separate option, for the same reason as --pick: an optional value would take the meeting time.
+parser.add_argument('--trace-file', metavar='FILE',
+                    help='like --trace, but record to this file')
+
 parser.add_argument('-q', '--quiet', action='store_true',
                     help='print nothing to the console')
 
@@ -59,56 +80,47 @@ def tries_twice(func: Callable) -> Callable:
 @tries_twice
 def figure_out_meeting_info(raw_time: str, raw_zoom: str, config: Config) -> Meeting:
     """Get the meeting time and ID with whatever information is available."""
-    if args.recent:
-        try:
-            meeting = Meeting.from_dict(utils.open_file('Resources/recent.json'))
-            meeting.infer_wake()
-            return meeting
-        except KeyError:
+    if args.recent or args.pick is not None:
+        meeting = History().lookup(args.pick or 1)
+        if meeting is None:
             print('No recent meeting info was found.')
             exit()
+        meeting.infer_wake()
+        return meeting
 
     if args.input:
         time = Time.from_string(ask=True)
-        zoom = Meeting.parse_id(ask=True)
-        meeting = Meeting(time, zoom)
+        zoom, pwd = Meeting.parse_link(ask=True)
+        meeting = Meeting(time, zoom, pwd=pwd)
         meeting.infer_wake()
         return meeting
 
     if raw_time == 'auto' and raw_zoom == 'auto':
-        meeting = Meeting.next()
-        last = Meeting.last()
-
-        if last is not None:
-            dx = (utils.time() - last.time.as_dt_time(full=True)).seconds // 60
-            if args.late or dx < config.threshold:
-                return last
-        elif args.late:
-            if not args.quiet:
-                print('According to the schedule, no classes have passed today.')
-            exit()
-
+        meeting = Meeting.closest(config.threshold, args.late)
         if meeting is not None:
             return meeting
-        else:
+
+        if args.late:
             if not args.quiet:
-                print('Your schedule is empty. Run "autopilot -c" to open settings '
-                      'and edit your schedule. You can also pass meeting time & ID '
-                      f'as arguments. Check the README for a full guide: {readme}')
-            exit()
+                print('According to the schedule, no classes have passed today.')
+        elif not args.quiet:
+            print('Your schedule is empty. Run "autopilot -c" to open settings '
+                  'and edit your schedule. You can also pass meeting time & ID '
+                  f'as arguments. Check the README for a full guide: {readme}')
+        exit()
 
     if raw_time != 'auto' and raw_zoom != 'auto':
         time = Time.from_string(raw_time)
-        zoom = Meeting.parse_id(raw_zoom)
-        meeting = Meeting(time, zoom)
+        zoom, pwd = Meeting.parse_link(raw_zoom)
+        meeting = Meeting(time, zoom, pwd=pwd)
     else:
         time = Time.from_string(raw_time)
-        zoom = Meeting.parse_id(raw_zoom)
+        zoom, pwd = Meeting.parse_link(raw_zoom)
         # if time is None:
         #     time = Time.from_string(ask=True)
         if zoom is None:
-            zoom = Meeting.parse_id(ask=True)
-        meeting = Meeting(time, zoom)
+            zoom, pwd = Meeting.parse_link(ask=True)
+        meeting = Meeting(time, zoom, pwd=pwd)
 
     meeting.infer_wake()
     return meeting
@@ -0,0 +1,107 @@
+from typing import Any, Optional, Callable, Dict, List
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from email.message import EmailMessage
+import asyncio
+import smtplib
+import threading
+
+
+# The follow-up work of a join (notification, history, cleanup) runs on an event loop of its own, in the
+# background: every task at once, each with a timeout. The tasks themselves are blocking (sockets, files),
+# so they run in a small thread pool, and the loop only waits on them.
+class Pipeline:
+    """Runs batches of tasks concurrently, in the background. Submitting returns right away; the results
+    (None, or the exception of a task that failed or timed out) can be waited for with drain."""
+    def __init__(self, timeout=20., workers=4):
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(workers, 'postjoin')
+        self.loop = asyncio.new_event_loop()
+        self.pending: List[Future] = []
+        threading.Thread(target=self.loop.run_forever, name='postjoin', daemon=True).start()
+
+    def submit(self, tasks: Dict[str, Callable[[], Any]]) -> Future:
+        """Start the tasks. The future resolves to {name: None or exception}. It is kept (even once done)
+        until drain returns its results."""
+        future = asyncio.run_coroutine_threadsafe(self.run(tasks), self.loop)
+        self.pending.append(future)
+        return future
+
+    async def run(self, tasks: Dict[str, Callable[[], Any]]) -> Dict[str, Optional[BaseException]]:
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(
+            *(asyncio.wait_for(loop.run_in_executor(self.executor, task), self.timeout) for task in tasks.values()),
+            return_exceptions=True)
+        return {name: result if isinstance(result, BaseException) else None
+                for name, result in zip(tasks, results)}
+
+    def drain(self, timeout: Optional[float] = None) -> List[Dict[str, Optional[BaseException]]]:
+        """Wait for every batch still running (at most timeout seconds). Returns the results of those that ended,
+        in the order they were submitted."""
+        done, _ = wait(self.pending, timeout)
+        results = [f.result() for f in self.pending if f in done]
+        self.pending = [f for f in self.pending if f not in done]
+        return results
+
+
+class Notifier:
+    """Sends emails through one SMTP connection, kept open between joins (in daemon mode), and opened again
+    if the server dropped it. Port 465 is SMTP over SSL (Gmail's default). On other ports, STARTTLS and login
+    are used only if the server offers them, so a local stand-in server works too."""
+    def __init__(self, sender: str, password: Optional[str] = None, host='smtp.gmail.com', port=465,
+                 timeout=10.):
+        self.sender = sender
+        self.password = password
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.smtp: Optional[smtplib.SMTP] = None
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.sent = 0
+
+    def connect(self) -> smtplib.SMTP:
+        if self.port == 465:
+            smtp = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+            smtp.ehlo()
+        else:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            smtp.ehlo()
+            if smtp.has_extn('starttls'):
+                smtp.starttls()
+                smtp.ehlo()
+        if self.password and smtp.has_extn('auth'):
+            smtp.login(self.sender, self.password)
+        self.connections += 1
+        return smtp
+
+    def send(self, to: str, subject: str, body: str):
+        message = EmailMessage()
+        message['From'] = self.sender
+        message['To'] = to
+        message['Subject'] = subject
+        message.set_content(body)
+        with self.lock:
+            reused = self.smtp is not None
+            if self.smtp is None:
+                self.smtp = self.connect()
+            try:
+                self.smtp.send_message(message)
+            except (smtplib.SMTPServerDisconnected, ConnectionError):
+                self.smtp = None
+                if not reused:
+                    raise
+                # The pooled connection went stale: try once with a new one.
+                self.smtp = self.connect()
+                self.smtp.send_message(message)
+            self.sent += 1
+
+    def close(self):
+        with self.lock:
+            if self.smtp is None:
+                return
+            try:
+                self.smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.smtp = None
+
@@ -0,0 +1,157 @@
+from typing import Any, Optional, Dict, List, NamedTuple
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from time import monotonic
+import os
+import sys
+import json
+import threading
+import subprocess
+
+
+# Long-lived command runner. The worker (this file, run as a script) reads JSON requests from stdin, one per line,
+# runs each command as soon as it arrives (so requests can be pipelined), and writes the results to stdout, tagged
+# with the id of the request. The daemon mode keeps one, started with sudo a single time, for the privileged
+# commands (pmset): the password is only piped once, and utils.sudo goes through it once utils.sudo_runner is set.
+# Other commands are not sent to a worker: it still runs a process for each, so nothing would be saved. A stand-in
+# runner (utils.runner, see StandInRunner) takes them all, for testing.
+class Result(NamedTuple):
+    code: int
+    stdout: str
+    elapsed: float
+    latency: float
+
+
+def serve(stdin=sys.stdin, stdout=sys.stdout):
+    """The worker loop."""
+    lock = threading.Lock()
+
+    def handle(request: Dict[str, Any]):
+        start = monotonic()
+        try:
+            proc = subprocess.run(request['argv'], text=True, stdin=subprocess.DEVNULL,
+                                  stdout=subprocess.PIPE if request.get('capture') else subprocess.DEVNULL,
+                                  stderr=subprocess.DEVNULL)
+            code, out = proc.returncode, proc.stdout or ''
+        except OSError:
+            code, out = 127, ''
+        response = json.dumps(dict(id=request['id'], code=code, stdout=out, elapsed=monotonic() - start))
+        with lock:
+            stdout.write(response + '\n')
+            stdout.flush()
+
+    for line in stdin:
+        try:
+            request = json.loads(line)
+        except ValueError:
+            request = None
+        if not isinstance(request, dict):
+            # E.g. a password that sudo didn't need, because it was cached.
+            continue
+        threading.Thread(target=handle, args=(request,), daemon=True).start()
+
+
+class Runner:
+    """Client of a worker process, started on the first command. Keeps the latency of every command (the
+    round trip, in seconds) by executable."""
+    path = os.path.abspath(__file__)
+
+    def __init__(self, password: Optional[str] = None):
+        self.password = password
+        self.proc: Optional[subprocess.Popen] = None
+        self.lock = threading.Lock()
+        self.next_id = 0
+        self.pending: Dict[int, Future] = {}
+        self.latencies: Dict[str, List[float]] = {}
+
+    def start(self):
+        argv = [sys.executable, self.path]
+        if self.password is not None:
+            # Check the password first: a worker that sudo turned down would only be noticed by its silence.
+            check = subprocess.run(['sudo', '-S', '-v', '-p', ''], input=self.password + '\n', text=True,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            if check.returncode != 0:
+                raise PermissionError('sudo refused the password.')
+            argv = ['sudo', '-S', '-p', '', *argv]
+        self.proc = subprocess.Popen(argv, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, bufsize=1)
+        if self.password is not None:
+            self.proc.stdin.write(self.password + '\n')
+        threading.Thread(target=self.read, daemon=True).start()
+
+    def read(self):
+        for line in self.proc.stdout:
+            response = json.loads(line)
+            with self.lock:
+                future = self.pending.pop(response['id'], None)
+            if future is not None:
+                future.set_result(response)
+        # The worker exited (e.g. sudo was denied): fail whatever was still waiting.
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        for future in pending.values():
+            future.set_exception(ConnectionError('The command runner exited.'))
+
+    def submit(self, argv: List[str], capture=False) -> Future:
+        """Send a command without waiting for it. The future resolves to the worker's response."""
+        future = Future()
+        with self.lock:
+            if self.proc is None or self.proc.poll() is not None:
+                self.start()
+            self.next_id += 1
+            self.pending[self.next_id] = future
+            self.proc.stdin.write(json.dumps(dict(id=self.next_id, argv=argv, capture=capture)) + '\n')
+        return future
+
+    def call(self, argv: List[str], capture=False, timeout: Optional[float] = 60.) -> Result:
+        """Run a command and wait for it, at most timeout seconds (then TimeoutError is raised, and the
+        response will be ignored if it ever comes)."""
+        start = monotonic()
+        future = self.submit(argv, capture)
+        try:
+            response = future.result(timeout)
+        except FutureTimeout:
+            with self.lock:
+                self.pending = {k: f for k, f in self.pending.items() if f is not future}
+            raise TimeoutError(f'{argv[0]} took more than {timeout} seconds.') from None
+        latency = monotonic() - start
+        self.latencies.setdefault(os.path.basename(argv[0]), []).append(latency)
+        return Result(response['code'], response['stdout'], response['elapsed'], latency)
+
+    def elevated(self, password: str) -> 'Runner':
+        """A runner for privileged commands: its worker is started with sudo, once."""
+        return Runner(password)
+
+    def summary(self) -> str:
+        lines = [f'{"Command":<16}{"Count":>7}{"Mean (ms)":>12}{"Max (ms)":>12}']
+        for name, latencies in self.latencies.items():
+            lines.append(f'{name:<16}{len(latencies):>7}{sum(latencies) / len(latencies) * 1000:>12.1f}'
+                         f'{max(latencies) * 1000:>12.1f}')
+        return '\n'.join(lines)
+
+    def close(self):
+        if self.proc is not None and self.proc.poll() is None:
+            self.proc.stdin.close()
+            self.proc.wait()
+
+
+class StandInRunner(Runner):
+    """Runs nothing: records the commands and answers with canned exit codes and outputs (by executable).
+    For testing code that goes through utils.run, utils.output and utils.sudo."""
+    def __init__(self, codes: Optional[Dict[str, int]] = None, outputs: Optional[Dict[str, str]] = None,
+                 password: Optional[str] = None):
+        super().__init__(password)
+        self.codes = codes or {}
+        self.outputs = outputs or {}
+        self.commands: List[List[str]] = []
+
+    def submit(self, argv: List[str], capture=False) -> Future:
+        self.commands.append(list(argv))
+        future = Future()
+        future.set_result(dict(code=self.codes.get(argv[0], 0), stdout=self.outputs.get(argv[0], ''), elapsed=0.))
+        return future
+
+    def elevated(self, password: str) -> Runner:
+        return StandInRunner(self.codes, self.outputs, password)
+
+
+if __name__ == '__main__':
+    serve()
@@ -0,0 +1,302 @@
+from typing import Any, Optional, Tuple, List, Dict, NamedTuple
+import os
+import plistlib
+import importlib.util
+
+import numpy as np
+
+import utils
+
+
+class Backend:
+    """Captures a region of the screen as a (height, width, 3) RGB array of uint8.
+    Regions are given in pixels, not in points."""
+    def grab(self, left: int, top: int, width: int, height: int) -> np.ndarray:
+        raise NotImplementedError
+
+    def size(self) -> Tuple[int, int]:
+        """Width and height of the screen, in pixels."""
+        raise NotImplementedError
+
+    def points(self) -> Tuple[int, int]:
+        """Width and height of the screen, in points (the coordinates of the mouse)."""
+        raise NotImplementedError
+
+
+class PyAutoGUIBackend(Backend):
+    """Captures the screen with PyAutoGUI (one screenshot per grab)."""
+    def grab(self, left: int, top: int, width: int, height: int) -> np.ndarray:
+        image = utils.pag.screenshot(region=(left, top, width, height))
+        return np.asarray(image.convert('RGB'))
+
+    def size(self) -> Tuple[int, int]:
+        return utils.pag.screenshot().size
+
+    def points(self) -> Tuple[int, int]:
+        return tuple(utils.pag.size())
+
+
+class QuartzBackend(Backend):
+    """Captures the screen in memory with Quartz (which PyAutoGUI depends on, on macOS), without the temporary
+    screenshot files of PyAutoGUI. Every grab is drawn into the same bitmap, allocated once for the whole screen,
+    and returned as a view of it (no copy): a frame is only valid until the next grab. Quartz is imported on the
+    first use, since the Objective-C runtime must not be loaded before the server forks."""
+    def __init__(self):
+        self.display = None
+        self.context = None
+        self.buffer: Optional[np.ndarray] = None
+        self.scale = 1.
+
+    def setup(self):
+        import Quartz
+        self.display = Quartz.CGMainDisplayID()
+        width, height = self.size()
+        # 32-bit little-endian, alpha first: BGRA bytes in memory.
+        self.context = Quartz.CGBitmapContextCreate(
+            None, width, height, 8, width * 4, Quartz.CGColorSpaceCreateDeviceRGB(),
+            Quartz.kCGImageAlphaPremultipliedFirst | Quartz.kCGBitmapByteOrder32Little)
+        memory = Quartz.CGBitmapContextGetData(self.context).as_buffer(width * height * 4)
+        self.buffer = np.frombuffer(memory, np.uint8).reshape((height, width, 4))
+        self.scale = width / self.points()[0]
+
+    def grab(self, left: int, top: int, width: int, height: int) -> np.ndarray:
+        import Quartz
+        if self.context is None:
+            self.setup()
+        # The rect is in points, and the image comes in pixels.
+        scale = self.scale
+        image = Quartz.CGDisplayCreateImageForRect(
+            self.display, Quartz.CGRectMake(left / scale, top / scale, width / scale, height / scale))
+        # The context's origin is at the bottom left: this draws the image over the top rows of the buffer.
+        Quartz.CGContextDrawImage(
+            self.context, Quartz.CGRectMake(0, self.buffer.shape[0] - height, width, height), image)
+        # BGRA to RGB, as a view.
+        return self.buffer[:height, :width, 2::-1]
+
+    def size(self) -> Tuple[int, int]:
+        import Quartz
+        mode = Quartz.CGDisplayCopyDisplayMode(Quartz.CGMainDisplayID())
+        return Quartz.CGDisplayModeGetPixelWidth(mode), Quartz.CGDisplayModeGetPixelHeight(mode)
+
+    def points(self) -> Tuple[int, int]:
+        import Quartz
+        bounds = Quartz.CGDisplayBounds(Quartz.CGMainDisplayID())
+        return int(bounds.size.width), int(bounds.size.height)
+
+
+class FakeBackend(Backend):
+    """Serves grabs from an in-memory framebuffer. Useful for testing on a headless box:
+    paint the framebuffer, then evaluate probes against it."""
+    def __init__(self, width: int, height: int, rgb: Tuple[int, int, int] = (0, 0, 0), factor=2):
+        self.frame = np.empty((height, width, 3), np.uint8)
+        self.frame[:] = rgb
+        self.factor = factor
+        self.grabs = 0
+
+    def size(self) -> Tuple[int, int]:
+        return self.frame.shape[1], self.frame.shape[0]
+
+    def points(self) -> Tuple[int, int]:
+        return self.frame.shape[1] // self.factor, self.frame.shape[0] // self.factor
+
+    def paint(self, x: int, y: int, rgb: Tuple[int, int, int], radius=0):
+        """Paint a square around pixel (x, y)."""
+        self.frame[max(y - radius, 0):y + radius + 1, max(x - radius, 0):x + radius + 1] = rgb
+
+    def grab(self, left: int, top: int, width: int, height: int) -> np.ndarray:
+        self.grabs += 1
+        return self.frame[top:top + height, left:left + width]
+
+
+# In-memory capture when Quartz is there (checked without importing it), screenshots through PyAutoGUI otherwise.
+backend: Backend = QuartzBackend() if importlib.util.find_spec('Quartz') else PyAutoGUIBackend()
+
+
+class Probe(NamedTuple):
+    """Color expected at point (x, y), with a per-channel tolerance."""
+    x: int
+    y: int
+    rgb: Tuple[int, int, int]
+    tolerance: int = 5
+
+
+class Probes:
+    """A batch of color probes. Evaluating it takes one capture of the bounding region of
+    all the probes, and checks every probe against it at once."""
+    def __init__(self, *probes: Probe):
+        self.probes = probes
+        self.xs = np.array([p.x for p in probes]) * utils.factor
+        self.ys = np.array([p.y for p in probes]) * utils.factor
+        self.colors = np.array([p.rgb for p in probes], np.int16)
+        self.tolerances = np.array([p.tolerance for p in probes], np.int16)
+        self.left, self.top = int(self.xs.min()), int(self.ys.min())
+        self.width = int(self.xs.max()) - self.left + 1
+        self.height = int(self.ys.max()) - self.top + 1
+
+    def sample(self, source: Optional[Backend] = None) -> np.ndarray:
+        """The current (r, g, b) values under every probe."""
+        frame = (source or backend).grab(self.left, self.top, self.width, self.height)
+        return frame[self.ys - self.top, self.xs - self.left, :3].astype(np.int16)
+
+    def match(self, pixels: np.ndarray) -> np.ndarray:
+        """Boolean array, one value per probe, telling whether the sampled color matches."""
+        return (np.abs(pixels - self.colors) <= self.tolerances[:, None]).all(axis=1)
+
+    def evaluate(self, source: Optional[Backend] = None) -> np.ndarray:
+        return self.match(self.sample(source))
+
+    def any(self, source: Optional[Backend] = None) -> bool:
+        return bool(self.evaluate(source).any())
+
+    def all(self, source: Optional[Backend] = None) -> bool:
+        return bool(self.evaluate(source).all())
+
+
+def zoom_version(app='/Applications/zoom.us.app') -> str:
+    """Version of the Zoom app, from its Info.plist."""
+    try:
+        with open(os.path.join(app, 'Contents', 'Info.plist'), 'rb') as f:
+            return str(plistlib.load(f).get('CFBundleShortVersionString', 'unknown'))
+    except (OSError, plistlib.InvalidFileException):
+        return 'unknown'
+
+
+def find_color(frame: np.ndarray, rgb: Tuple[int, int, int], width: int, height: int,
+               tolerance=5) -> np.ndarray:
+    """Top-left corners (x, y) of every width x height window of the frame that is entirely of the color.
+    This is template matching with a solid-color template: with an integral image of the matching pixels,
+    the sum of every window takes four lookups, whatever its size."""
+    mask = (np.abs(frame[..., :3].astype(np.int16) - rgb) <= tolerance).all(axis=2)
+    integral = np.zeros((mask.shape[0] + 1, mask.shape[1] + 1), np.int32)
+    np.cumsum(np.cumsum(mask, axis=0, dtype=np.int32), axis=1, out=integral[1:, 1:])
+    sums = integral[height:, width:] - integral[:-height, width:] - integral[height:, :-width] + integral[:-height, :-width]
+    ys, xs = np.nonzero(sums == width * height)
+    return np.stack([xs, ys], axis=1)
+
+
+class Element(NamedTuple):
+    """A solid-colored part of Zoom's interface (e.g. a button), with its usual position, in points,
+    on the screen it was designed for. Size is the side of the square that is known to be of that color."""
+    name: str
+    x: int
+    y: int
+    rgb: Tuple[int, int, int]
+    size: int = 6
+    tolerance: int = 5
+
+
+class Search(Probes):
+    """Condition for an element that hasn't been located yet: a probe at its usual position, checked along with
+    the others by utils.wait_for. If it doesn't match, wait_for looks for the element over the whole screen
+    (see scan), once the screen settles. Once the element is seen, its position is saved and the probe moves
+    there, if needed."""
+    def __init__(self, locator: 'Locator', element: Element):
+        super().__init__(Probe(element.x, element.y, element.rgb, element.tolerance))
+        self.locator = locator
+        self.element = element
+        self.pending = True
+
+    def record(self, position: Optional[Tuple[int, int]] = None):
+        """Save the position of the element (by default, the one just probed)."""
+        probe = self.probes[0]
+        if position is not None:
+            probe = probe._replace(x=position[0], y=position[1])
+            super().__init__(probe)
+        if self.pending:
+            self.locator.record(self.element.name, (probe.x, probe.y))
+            self.pending = False
+
+
+def scan(searches: List[Search]) -> List[Search]:
+    """Look for the elements of the pending searches over the whole screen, with one capture per locator.
+    Returns the searches whose element was found."""
+    found = []
+    locators = {id(search.locator): search.locator for search in searches}
+    for locator in locators.values():
+        found += locator.scan([search for search in searches if search.locator is locator])
+    return found
+
+
+class Locator:
+    """Positions of the elements of Zoom's interface, and the scale factor of the screen (pixels per point).
+    They are calibrated once, and cached in Resources/calibration.json, by screen size and Zoom version.
+    Elements that were already located are checked with a single probe, like before. The others are probed at
+    their usual position, and searched for over the whole screen if they aren't there (see Search). Only elements
+    of a color of their own are searched for: the leave buttons share theirs, and one would be taken for the other."""
+    path = 'Resources/calibration.json'
+
+    def __init__(self, elements: List[Element], source: Optional[Backend] = None):
+        self.elements = {element.name: element for element in elements}
+        self.source = source or backend
+        width, height = self.source.points()
+        self.key = f'{width}x{height}, Zoom {zoom_version()}'
+        try:
+            self.cache: Dict[str, Any] = dict(utils.open_file(self.path))
+        except (OSError, ValueError):
+            self.cache = {}
+        self.entry = self.cache.get(self.key)
+        if self.entry is None:
+            self.entry = dict(factor=max(round(self.source.size()[0] / width), 1), elements={})
+            self.save()
+        utils.factor = self.entry['factor']
+
+    def save(self):
+        self.cache[self.key] = self.entry
+        utils.open_file(self.path, self.cache)
+
+    def position(self, name: str) -> Tuple[int, int]:
+        """Where the element is, in points: where it was found, or else its usual position."""
+        element = self.elements[name]
+        return tuple(self.entry['elements'].get(name, (element.x, element.y)))
+
+    def condition(self, name: str) -> Any:
+        """Condition (for utils.wait_for) that the element is on screen."""
+        element = self.elements[name]
+        if name in self.entry['elements']:
+            x, y = self.entry['elements'][name]
+            return Probes(Probe(x, y, element.rgb, element.tolerance))
+        return Search(self, element)
+
+    def searchable(self, element: Element) -> bool:
+        """Whether the element can be told apart by its color alone."""
+        return sum(other.rgb == element.rgb for other in self.elements.values()) == 1
+
+    def scan(self, searches: List[Search]) -> List[Search]:
+        """Look for the elements of the pending searches (those that can be) in one capture of the whole screen.
+        The ones found are recorded and returned."""
+        searches = [search for search in searches if search.pending and self.searchable(search.element)]
+        if not searches:
+            return []
+        width, height = self.source.size()
+        frame = self.source.grab(0, 0, width, height)
+        found = []
+        for search in searches:
+            position = self.search(search.element, frame)
+            if position is not None:
+                search.record(position)
+                found.append(search)
+        return found
+
+    def search(self, element: Element, frame: np.ndarray) -> Optional[Tuple[int, int]]:
+        """Center of the element in a capture of the whole screen, in points, or None if it is not there.
+        Positions already taken by other elements are left out. Among several matches, the one closest to
+        the usual position wins."""
+        factor = self.entry['factor']
+        side = element.size * factor
+        corners = find_color(frame, element.rgb, side, side, element.tolerance)
+        if not len(corners):
+            return
+        centers = corners + side // 2
+        for name, claimed in self.entry['elements'].items():
+            if name != element.name:
+                near = (np.abs(centers - np.array(claimed) * factor) <= side).all(axis=1)
+                centers = centers[~near]
+        if not len(centers):
+            return
+        distances = ((centers - (element.x * factor, element.y * factor)) ** 2).sum(axis=1)
+        x, y = centers[distances.argmin()] // factor
+        return int(x), int(y)
+
+    def record(self, name: str, position: Tuple[int, int]):
+        self.entry['elements'][name] = list(position)
+        self.save()
@@ -0,0 +1,125 @@
+from typing import List
+import os
+import sys
+import signal
+import socket
+import struct
+import threading
+import runpy
+import atexit
+import traceback
+
+import utils
+
+
+# Started with "autopilot --server". The ap/autopilot executables (Resources/autopilot.cpp) connect to this socket
+# and send their working dir, arguments and file descriptors (stdin, stdout & stderr). The server forks, and the
+# child runs main.py right in the client's terminal, with every module already imported. The exit code is sent back.
+# PyAutoGUI is not preloaded: macOS doesn't allow using the Objective-C runtime after a fork.
+socket_path = utils.full_path('autopilot.sock')
+main_path = utils.full_path('main.py')
+preload = ['model', 'parsing', 'configtool', 'screen']
+
+
+def recv_request(conn: socket.socket):
+    """Receive the length-prefixed request, and the file descriptors that come with it."""
+    data, fds, _, _ = socket.recv_fds(conn, 4096, 3)
+    if len(data) < 4 or len(fds) != 3:
+        raise ConnectionError('Malformed request.')
+    length, = struct.unpack('!I', data[:4])
+    data = data[4:]
+    while len(data) < length:
+        chunk = conn.recv(length - len(data))
+        if not chunk:
+            raise ConnectionError('Client disconnected.')
+        data += chunk
+    cwd, *argv = data.decode().split('\0')
+    return cwd, argv, fds
+
+
+def run_main(argv: List[str]) -> int:
+    """Run main.py as if it had been invoked with these arguments. Returns the exit code (1 if it raised)."""
+    import parsing
+    sys.argv = [main_path, *argv]
+    try:
+        parsing.args = parsing.parser.parse_args(argv)
+        if parsing.args.server:
+            sys.stderr.write('The Autopilot server is already running.\n')
+            return 2
+        runpy.run_path(main_path, run_name='__main__')
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0
+        sys.stderr.write(f'{e.code}\n')
+        return 1
+    except KeyboardInterrupt:
+        return 130
+    except Exception:
+        # Like without the server, the error ends up in the client's terminal (stderr is the client's by now).
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+def handle(conn: socket.socket):
+    """Serve one client. This runs in a forked child."""
+    cwd, argv, fds = recv_request(conn)
+    # Detach from the server's terminal, so getpass falls back to the client's stdin.
+    os.setsid()
+    for fd, target in zip(fds, range(3)):
+        os.dup2(fd, target)
+        os.close(fd)
+    os.chdir(cwd)
+
+    def watch():
+        # If the client goes away (e.g. ctrl+C), interrupt the command.
+        if not conn.recv(1):
+            os.kill(os.getpid(), signal.SIGINT)
+    threading.Thread(target=watch, daemon=True).start()
+
+    try:
+        code = run_main(argv)
+    finally:
+        # The child ends with os._exit, which skips the exit handlers of the command, e.g. those that
+        # close the --trace file and print the trace and runner summaries.
+        atexit._run_exitfuncs()
+        sys.stdout.flush()
+        sys.stderr.flush()
+    conn.sendall(struct.pack('!i', code))
+
+
+def serve():
+    """Accept clients until stopped, one forked child each."""
+    for module in preload:
+        try:
+            __import__(module)
+        except Exception:
+            pass
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen()
+    # Children are reaped automatically. On SIGTERM, clean up the socket too.
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit())
+    print(f'Autopilot server listening on {socket_path}. To stop it, use ctrl+C.')
+    try:
+        while True:
+            conn, _ = server.accept()
+            if os.fork() == 0:
+                server.close()
+                # Only the exit handlers of the command run in the child, not those of the server.
+                atexit._clear()
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                code = 1
+                try:
+                    handle(conn)
+                    code = 0
+                finally:
+                    os._exit(code)
+            conn.close()
+    finally:
+        server.close()
+        os.remove(socket_path)
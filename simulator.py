@@ -0,0 +1,125 @@
+"""Fast-forward simulator of the schedule, on a virtual clock. Run from the Autopilot folder:
+
+    python3 simulator.py [--start 2022-07-04T00:00] [--days 7] [--launch 8:05 12:30] [--late] [--threshold N]
+
+Without --launch, the daemon mode is replayed: every meeting of the schedule is waited for and joined, in order.
+With --launch, "autopilot" (or "autopilot --late") is invoked at those times of every day: it joins a meeting that
+started less than threshold minutes ago right away, or waits for the next one. Either way, the report shows which
+meeting was joined when, and how late."""
+from typing import List, NamedTuple, Optional
+from time import perf_counter
+import sys
+import argparse
+import datetime
+
+from model import Meeting, Agenda, Config, Time
+from wake import wait_for_wake
+import utils
+
+
+class Join(NamedTuple):
+    name: Optional[str]
+    scheduled: datetime.datetime
+    joined: Optional[datetime.datetime]
+    mode: str
+    wakeups: int = 0
+
+    @property
+    def lateness(self) -> float:
+        """Seconds between the meeting start and the moment it was joined."""
+        return (self.joined - self.scheduled).total_seconds()
+
+
+def replay_daemon(end: datetime.datetime, threshold: int, latency: float, interval: Optional[float]) -> List[Join]:
+    """Join every meeting until the end date, like the daemon mode."""
+    joins = []
+    agenda = Agenda()
+    while True:
+        meeting = agenda.pop(threshold)
+        if meeting is None or meeting.wake_time() >= end:
+            return joins
+        alarm = wait_for_wake(meeting, utils.clock, max_nap=interval)
+        utils.clock.sleep(latency)
+        joins.append(Join(meeting.name, meeting.wake_time(), utils.time(), 'waited', alarm.wakeups))
+
+
+def replay_launches(end: datetime.datetime, launches: List[Time], threshold: int,
+                    late: bool, latency: float, interval: Optional[float]) -> List[Join]:
+    """Invoke autopilot at the launch times of every day until the end date. A launch that would
+    happen while a previous one is still waiting or joining is skipped."""
+    joins = []
+    day = utils.time().date()
+    while day <= end.date():
+        for time in launches:
+            launch = datetime.datetime.combine(day, time.as_dt_time())
+            if launch < utils.time() or launch >= end:
+                continue
+            utils.clock.advance_to(launch)
+            meeting = Meeting.closest(threshold, late)
+            if meeting is None:
+                joins.append(Join(None, launch, None, 'nothing to join'))
+            elif meeting.is_right_now:
+                scheduled = meeting.time.as_dt_time(full=True)
+                utils.clock.sleep(latency)
+                joins.append(Join(meeting.name, scheduled, utils.time(), 'right now'))
+            else:
+                alarm = wait_for_wake(meeting, utils.clock, max_nap=interval)
+                utils.clock.sleep(latency)
+                joins.append(Join(meeting.name, meeting.wake_time(), utils.time(), 'waited', alarm.wakeups))
+        day += datetime.timedelta(days=1)
+    return joins
+
+
+def simulate(start: datetime.datetime, days: int, launches: Optional[List[Time]] = None,
+             threshold=10, late=False, latency=10., interval: Optional[float] = None) -> List[Join]:
+    """Replay the schedule from the start date, for a number of days. Latency is the (simulated)
+    number of seconds it takes to join a meeting once Zoom is opened, and interval the longest nap
+    while waiting (the sleep interval of the config)."""
+    old_clock = utils.clock
+    utils.clock = utils.VirtualClock(start)
+    end = start + datetime.timedelta(days=days)
+    try:
+        if launches:
+            return replay_launches(end, launches, threshold, late, latency, interval)
+        return replay_daemon(end, threshold, latency, interval)
+    finally:
+        utils.clock = old_clock
+
+
+def print_report(joins: List[Join]):
+    for join in joins:
+        when = join.scheduled.strftime('%a %m/%d %H:%M')
+        if join.joined is None:
+            print(f'{when}  {join.mode}')
+            continue
+        print(f'{when}  {join.name:<30} joined {join.joined.strftime("%H:%M:%S")}  '
+              f'{join.lateness:+8.0f}s  ({join.mode}' + f', {join.wakeups} wakeups' * bool(join.wakeups) + ')')
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(prog='simulator.py')
+    parser.add_argument('--start', type=datetime.datetime.fromisoformat, default=None,
+                        help='date & time to start from (ISO format), defaults to now')
+    parser.add_argument('--days', type=int, default=7, help='number of days to replay, defaults to 7')
+    parser.add_argument('--launch', type=Time.from_string, nargs='+', metavar='HH:MM',
+                        help='times of the day at which autopilot is invoked, instead of the daemon mode')
+    parser.add_argument('--late', action='store_true', help='invoke autopilot with --late')
+    parser.add_argument('--threshold', type=int, default=None,
+                        help='late-to-class threshold in minutes, defaults to the one of your config')
+    parser.add_argument('--latency', type=float, default=10.,
+                        help='seconds it takes to join once Zoom is opened, defaults to 10')
+    args = parser.parse_args(argv)
+
+    config = Config()
+    threshold = config.threshold if args.threshold is None else args.threshold
+    began = perf_counter()
+    joins = simulate(args.start or datetime.datetime.now(), args.days, args.launch,
+                     threshold, args.late, args.latency, config.interval)
+    elapsed = perf_counter() - began
+    print_report(joins)
+    print(f'\n{len(joins)} launch(es) and join(s) over {args.days} day(s), simulated in {elapsed * 1000:.0f} ms.')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,215 @@
+from typing import Optional, Tuple, List, Iterable
+import os
+import json
+import sqlite3
+
+from model import day_minutes, week_minutes
+import utils
+
+
+# Optional SQLite backend of the schedule, enabled with "sqlite": true in userconfig.json. Every meeting is a row,
+# and every (meeting, weekday) pair an occurrence, indexed by weekday and minute of the day, so lookups of the next
+# or last meeting are indexed queries instead of scans of the whole schedule. WAL mode lets the daemon read while
+# the config tool writes. On the first use, schedule.json is migrated (and kept as it is).
+schema = '''
+CREATE TABLE IF NOT EXISTS meetings (
+    id INTEGER PRIMARY KEY,
+    position INTEGER NOT NULL,
+    name TEXT,
+    zoom INTEGER,
+    hour INTEGER,
+    minute INTEGER,
+    days TEXT NOT NULL,
+    on_sched INTEGER NOT NULL,
+    duration INTEGER,
+    pwd TEXT,
+    until TEXT
+);
+CREATE TABLE IF NOT EXISTS occurrences (
+    meeting INTEGER NOT NULL REFERENCES meetings (id) ON DELETE CASCADE,
+    weekday INTEGER NOT NULL,
+    minute INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    zoom INTEGER
+);
+CREATE INDEX IF NOT EXISTS meetings_zoom ON meetings (zoom);
+CREATE INDEX IF NOT EXISTS occurrences_time ON occurrences (weekday, minute, position);
+CREATE INDEX IF NOT EXISTS occurrences_zoom ON occurrences (zoom, weekday, minute);
+'''
+
+columns = 'm.id, m.name, m.zoom, m.hour, m.minute, m.days, m.on_sched, m.duration, m.pwd, m.until'
+# Meetings that are not over (see Meeting.until): the ISO dates compare as strings.
+current = '(m.until IS NULL OR m.until >= ?)'
+
+
+def as_dict(row: tuple) -> dict:
+    """A meeting row as the dict of schedule.json (see Meeting.as_dict)."""
+    _, name, zoom, hour, minute, days, on_sched, duration, pwd, until = row
+    return dict(time=None if hour is None else [hour, minute], zoom=zoom, name=name, days=json.loads(days),
+                on_sched=bool(on_sched), duration=duration, pwd=pwd, until=until)
+
+
+def now() -> str:
+    return utils.time().isoformat(timespec='minutes')
+
+
+class Store:
+    """Connection to the schedule database. Rows are returned as schedule.json dicts, with their row ids."""
+    path = 'Resources/schedule.db'
+
+    def __init__(self, path: Optional[str] = None, json_path='Resources/schedule.json'):
+        path = utils.full_path(path or self.path)
+        self.db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.writes = 0
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('PRAGMA foreign_keys=ON')
+        self.db.executescript(schema)
+        version = self.db.execute('PRAGMA user_version').fetchone()[0]
+        if version == 0:
+            self.migrate(json_path)
+        elif version == 1:
+            # Databases made before meetings could end.
+            with self.transaction():
+                self.db.execute('ALTER TABLE meetings ADD COLUMN until TEXT')
+                self.db.execute('PRAGMA user_version=2')
+
+    def migrate(self, json_path: str):
+        """Copy schedule.json into the database, once."""
+        schedule = []
+        if os.path.exists(utils.full_path(json_path)):
+            schedule = utils.open_file(json_path)
+        with self.transaction():
+            if not self.db.execute('SELECT 1 FROM meetings LIMIT 1').fetchone():
+                self._insert_all(schedule)
+            self.db.execute('PRAGMA user_version=2')
+
+    def transaction(self) -> 'Transaction':
+        """Context manager of a write transaction."""
+        return Transaction(self)
+
+    def version(self) -> Tuple[int, int]:
+        """Changes whenever the schedule is written, by this or any other connection, so that readers
+        know when to load it again."""
+        return self.db.execute('PRAGMA data_version').fetchone()[0], self.writes
+
+    # Reads
+
+    def all(self) -> List[Tuple[int, dict]]:
+        """The whole schedule, in order, with the row ids."""
+        rows = self.db.execute(f'SELECT {columns} FROM meetings m ORDER BY m.position')
+        return [(row[0], as_dict(row)) for row in rows]
+
+    def of_day(self, day: int, reverse=False) -> List[dict]:
+        """Meetings of a weekday (1-7, 1 is Monday) that are not over, sorted by time, then by position in
+        the schedule. So are those of the lookups below."""
+        order = 'DESC' if reverse else 'ASC'
+        rows = self.db.execute(
+            f'SELECT {columns} FROM occurrences o JOIN meetings m ON m.id = o.meeting '
+            f'WHERE o.weekday = ? AND {current} ORDER BY o.minute {order}, o.position {order}', (day, now()))
+        return list(map(as_dict, rows))
+
+    def after(self, minute: int, zoom: Optional[int] = None) -> Optional[Tuple[int, dict]]:
+        """First occurrence strictly after the given minute of the week (with the given zoom ID, if any),
+        wrapping around to the next week. Returns the minutes left until it, and the meeting."""
+        day, minute_of_day = minute // day_minutes + 1, minute % day_minutes
+        by_zoom = '' if zoom is None else 'o.zoom = ? AND '
+        params = (now(),) if zoom is None else (zoom, now())
+        query = (f'SELECT o.weekday, o.minute, {columns} FROM occurrences o JOIN meetings m ON m.id = o.meeting '
+                 f'WHERE {by_zoom}{current} AND {{}} ORDER BY o.weekday, o.minute, o.position LIMIT 1')
+        row = self.db.execute(query.format('(o.weekday > ? OR o.weekday = ? AND o.minute > ?)'),
+                              params + (day, day, minute_of_day)).fetchone()
+        if row is None:
+            row = self.db.execute(query.format('1'), params).fetchone()
+            if row is None:
+                return
+            return (row[0] - 1) * day_minutes + row[1] + week_minutes - minute, as_dict(row[2:])
+        return (row[0] - 1) * day_minutes + row[1] - minute, as_dict(row[2:])
+
+    def before(self, minute: int, zoom: Optional[int] = None) -> Optional[dict]:
+        """Last occurrence at or before the given minute of the week, as long as it is on the same day.
+        Among meetings at the same time, the first one in the schedule."""
+        day, minute_of_day = minute // day_minutes + 1, minute % day_minutes
+        by_zoom = '' if zoom is None else 'o.zoom = ? AND '
+        params = (now(),) if zoom is None else (zoom, now())
+        row = self.db.execute(
+            f'SELECT {columns} FROM occurrences o JOIN meetings m ON m.id = o.meeting '
+            f'WHERE {by_zoom}{current} AND o.weekday = ? AND o.minute <= ? '
+            f'ORDER BY o.minute DESC, o.position LIMIT 1', params + (day, minute_of_day)).fetchone()
+        return None if row is None else as_dict(row)
+
+    # Writes
+
+    def _occurrences(self, row_id: int, meeting: dict, position: int):
+        if meeting['time'] is None:
+            return
+        minute = meeting['time'][0] * 60 + meeting['time'][1]
+        self.db.executemany(
+            'INSERT INTO occurrences (meeting, weekday, minute, position, zoom) VALUES (?, ?, ?, ?, ?)',
+            [(row_id, day, minute, position, meeting['zoom']) for day in set(meeting['days'] or [])])
+
+    def _insert(self, meeting: dict, position: int) -> int:
+        time = meeting['time'] or (None, None)
+        cursor = self.db.execute(
+            'INSERT INTO meetings (position, name, zoom, hour, minute, days, on_sched, duration, pwd, until) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (position, meeting['name'], meeting['zoom'], time[0], time[1], json.dumps(meeting['days'] or []),
+             int(bool(meeting['on_sched'])), meeting.get('duration'), meeting.get('pwd'), meeting.get('until')))
+        self._occurrences(cursor.lastrowid, meeting, position)
+        return cursor.lastrowid
+
+    def _insert_all(self, schedule: Iterable[dict]):
+        for position, meeting in enumerate(schedule):
+            self._insert(meeting, position)
+
+    def insert(self, meeting: dict) -> int:
+        """Add a meeting at the end of the schedule. Returns its row id."""
+        with self.transaction():
+            position = self.db.execute('SELECT COALESCE(MAX(position) + 1, 0) FROM meetings').fetchone()[0]
+            return self._insert(meeting, position)
+
+    def update(self, row_id: int, meeting: dict):
+        """Replace a meeting, keeping its place in the schedule."""
+        time = meeting['time'] or (None, None)
+        with self.transaction():
+            position = self.db.execute('SELECT position FROM meetings WHERE id = ?', (row_id,)).fetchone()[0]
+            self.db.execute(
+                'UPDATE meetings SET name = ?, zoom = ?, hour = ?, minute = ?, days = ?, on_sched = ?, '
+                'duration = ?, pwd = ?, until = ? WHERE id = ?',
+                (meeting['name'], meeting['zoom'], time[0], time[1], json.dumps(meeting['days'] or []),
+                 int(bool(meeting['on_sched'])), meeting.get('duration'), meeting.get('pwd'), meeting.get('until'),
+                 row_id))
+            self.db.execute('DELETE FROM occurrences WHERE meeting = ?', (row_id,))
+            self._occurrences(row_id, meeting, position)
+
+    def delete(self, row_id: int):
+        """Remove a meeting (its occurrences go with it)."""
+        with self.transaction():
+            self.db.execute('DELETE FROM meetings WHERE id = ?', (row_id,))
+
+    def replace(self, schedule: Iterable[dict]):
+        """Replace the whole schedule, in one transaction."""
+        with self.transaction():
+            self.db.execute('DELETE FROM meetings')
+            self._insert_all(schedule)
+
+
+class Transaction:
+    """BEGIN IMMEDIATE ... COMMIT, or ROLLBACK on an exception. Nested transactions join the outer one."""
+    def __init__(self, store: Store):
+        self.store = store
+        self.outer = False
+
+    def __enter__(self):
+        if not self.store.db.in_transaction:
+            self.store.db.execute('BEGIN IMMEDIATE')
+            self.outer = True
+
+    def __exit__(self, exc_type, *_):
+        if not self.outer:
+            return
+        if exc_type is None:
+            self.store.db.execute('COMMIT')
+            self.store.writes += 1
+        else:
+            self.store.db.execute('ROLLBACK')
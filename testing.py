@@ -0,0 +1,624 @@
+"""Benchmarks for Autopilot. Run from the Autopilot folder:
+
+    python3 testing.py importtime [--save FILE] [--compare FILE]
+    python3 testing.py bench [--sizes 10 1000] [--save FILE] [--compare FILE]
+    python3 testing.py check
+
+importtime measures the import cost of every module with "python -X importtime", and lists
+the slowest modules each one pulls in.
+
+bench times schedule lookups, meeting info parsing, ID parsing, file reading and the config
+tool views, against synthetic schedules of growing size (in a temporary sources folder, with
+the clock frozen at a fixed date).
+
+check runs behaviour checks of the stand-ins that replace the screen, Zoom, the system and the mail server on a headless
+box (e.g. screen.FakeBackend), each in a temporary sources folder.
+
+With --compare, results that got slower than the baseline by more than the threshold are
+reported, and the exit code is 1."""
+from typing import Callable, Dict, Iterator, List, Optional
+from contextlib import contextmanager
+import sys
+import os
+import json
+import glob
+import shutil
+import random
+import argparse
+import datetime
+import tempfile
+import socket
+import threading
+import subprocess
+import traceback
+import socketserver
+from timeit import Timer
+
+
+here = os.path.dirname(os.path.abspath(__file__))
+modules = ['utils', 'model', 'parsing', 'configtool', 'screen']
+sizes = [10, 1000, 10000, 100000]
+frozen_time = datetime.datetime(2022, 7, 5, 9, 30, 15)
+
+
+# IMPORT TIME
+
+
+def import_time(module: str, runs=5, top=10) -> Optional[dict]:
+    """Cumulative import time of a module in microseconds (best of a few runs in fresh interpreters),
+    with the self time of the slowest modules it imports. None if the module can't be imported."""
+    best = None
+    for _ in range(runs):
+        proc = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+            cwd=here, capture_output=True, text=True)
+        if proc.returncode != 0:
+            return
+        breakdown: Dict[str, int] = {}
+        total = 0
+        for line in proc.stderr.splitlines():
+            if not line.startswith('import time:') or 'self [us]' in line:
+                continue
+            self_us, cumulative, name = line[len('import time:'):].split('|')
+            name = name.strip()
+            breakdown[name] = int(self_us)
+            if name == module:
+                total = int(cumulative)
+        if best is None or total < best['total']:
+            slowest = sorted(breakdown.items(), key=lambda item: item[1], reverse=True)[:top]
+            best = dict(total=total, modules=dict(slowest))
+    return best
+
+
+def import_times(names: List[str]) -> Dict[str, Optional[dict]]:
+    return {name: import_time(name) for name in names}
+
+
+def print_import_times(results: Dict[str, Optional[dict]]):
+    for name, result in results.items():
+        if result is None:
+            print(f'{name}: could not be imported')
+            continue
+        print(f'{name}: {result["total"] / 1000:.1f} ms')
+        for module, self_us in result['modules'].items():
+            print(f'    {module:<40} {self_us / 1000:8.1f} ms')
+
+
+# BENCHMARKS
+
+
+def synthetic_schedule(size: int, seed=0) -> List[dict]:
+    """A reproducible schedule of meetings with random weekdays and times."""
+    rng = random.Random(seed)
+    return [dict(time=[rng.randrange(24), rng.randrange(60)], zoom=10 ** 9 + k, name=f'Meeting {k}',
+                 days=sorted(rng.sample(range(1, 8), rng.randint(1, 3))), on_sched=True)
+            for k in range(size)]
+
+
+def best_time(func: Callable, number: int, repeat=5) -> float:
+    """Best time per call of a function, in microseconds."""
+    return min(Timer(func).repeat(repeat, number)) / number * 1e6
+
+
+def import_parsing():
+    """parsing reads the command line arguments when imported, so hide the ones of this script."""
+    argv = sys.argv
+    sys.argv = ['autopilot']
+    try:
+        import parsing
+    finally:
+        sys.argv = argv
+    return parsing
+
+
+def bench_size(size: int) -> Dict[str, float]:
+    """Run every benchmark against a schedule of the given size. The sources folder must be set up."""
+    import utils
+    from model import Meeting, Config
+    parsing = import_parsing()
+    import configtool
+
+    schedule = synthetic_schedule(size)
+    utils.open_file('Resources/schedule.json', schedule)
+    links = [f'https://example.zoom.us/j/{m["zoom"]}?pwd=abc' for m in schedule[:100]]
+    number = max(1, 10000 // size)
+    config = Config()
+    configtool.config = config
+    configtool.load_schedule()
+
+    def uncached_read():
+        utils.cache.clear()
+        utils.open_file('Resources/schedule.json')
+
+    def reload_schedule():
+        utils.cache.clear()
+        Meeting.timeline()
+
+    results = dict(
+        reload_schedule=best_time(reload_schedule, 1, 3),
+        next=best_time(Meeting.next, number * 10),
+        last=best_time(Meeting.last, number * 10),
+        next_with_id=best_time(lambda: Meeting.schedule_lookup(Meeting(zoom=schedule[-1]['zoom'])), number * 10),
+        figure_out_meeting_info=best_time(lambda: parsing.figure_out_meeting_info(config), number * 10),
+        parse_id=best_time(lambda: [utils.parse_id(link) for link in links], 100) / len(links),
+        open_file_cached=best_time(lambda: utils.open_file('Resources/schedule.json'), 1000),
+        open_file_uncached=best_time(uncached_read, number),
+        schedule_view=best_time(lambda: configtool.schedule_view(0), number),
+        meeting_view=best_time(lambda: configtool.meeting_view(Meeting.from_dict(schedule[0])), 1000))
+    return {f'{name}/{size}': us for name, us in results.items()}
+
+
+@contextmanager
+def sandbox() -> Iterator[str]:
+    """A temporary sources folder with the text resources and the config of this one, and the clock
+    frozen at a fixed date. Yields the folder."""
+    import utils
+    old = utils.sources_path, utils.clock, utils.factor, utils.runner, utils.sudo_runner
+    with tempfile.TemporaryDirectory() as temp:
+        os.mkdir(os.path.join(temp, 'Resources'))
+        for file in glob.glob(os.path.join(here, 'Resources', '*.txt')) + \
+                [os.path.join(here, 'Resources', 'userconfig.json')]:
+            shutil.copy(file, os.path.join(temp, 'Resources'))
+        utils.sources_path = temp + '/'
+        utils.clock = utils.VirtualClock(frozen_time)
+        try:
+            yield temp
+        finally:
+            utils.sources_path, utils.clock, utils.factor, utils.runner, utils.sudo_runner = old
+
+
+def bench(bench_sizes: List[int]) -> Dict[str, dict]:
+    """Run the benchmarks in a temporary sources folder, with the clock frozen."""
+    with sandbox():
+        results = {}
+        for size in bench_sizes:
+            results.update(bench_size(size))
+    return {name: dict(us=us) for name, us in results.items()}
+
+
+def print_bench(results: Dict[str, dict]):
+    for name, result in results.items():
+        print(f'{name:<40} {result["us"]:12.1f} us')
+
+
+# CHECKS
+
+
+def check_probes():
+    """A batch of probes is evaluated with one capture of the fake framebuffer, within tolerance."""
+    import screen
+    fake = screen.FakeBackend(400, 200)
+    fake.paint(2 * 20, 2 * 40, (239, 124, 65), radius=2)
+    probes = screen.Probes(screen.Probe(20, 40, (242, 121, 65)), screen.Probe(50, 30, (0, 0, 0)),
+                           screen.Probe(21, 41, (239, 124, 65)), screen.Probe(60, 10, (4, 4, 6)))
+    assert list(probes.evaluate(fake)) == [True, True, True, False]
+    assert fake.grabs == 1
+    assert not probes.all(fake) and probes.any(fake)
+
+
+def check_locator():
+    """On the 1440x900 layout, a windowed meeting is seen as windowed, and the fullscreen leave button (of the
+    same color) is not searched for, so its position isn't mistaken for the windowed one. An element of a color
+    of its own that moved is found over the whole screen once the screen settles, and its position saved."""
+    import utils
+    import screen
+    fake = screen.FakeBackend(2880, 1800)
+    elements = [screen.Element('home', 122, 276, (239, 124, 65)),
+                screen.Element('fullscreen', 1372, 872, (169, 53, 47)),
+                screen.Element('windowed', 1421, 784, (169, 53, 47))]
+    old_backend, screen.backend = screen.backend, fake
+    try:
+        locator = screen.Locator(elements)
+        fake.paint(1421 * 2, 784 * 2, (169, 53, 47), radius=12)
+        in_meeting = dict(fullscreen=locator.condition('fullscreen'), windowed=locator.condition('windowed'))
+        assert utils.wait_for(in_meeting, 10) == 'windowed'
+        assert utils.wait_for(dict(fullscreen=in_meeting['fullscreen']), 3) is None
+        assert not in_meeting['fullscreen'].all()
+        assert 'fullscreen' not in locator.entry['elements']
+
+        fake.paint(300 * 2, 200 * 2, (239, 124, 65), radius=12)
+        grabs = fake.grabs
+        assert utils.wait_for(dict(home=locator.condition('home')), 8) == 'home'
+        x, y = locator.entry['elements']['home']
+        assert abs(x - 300) <= 6 and abs(y - 200) <= 6
+        assert screen.Locator(elements).condition('home').all()
+        # One capture of the probe per poll until the screen settles, then one of the whole screen.
+        assert fake.grabs - grabs <= 8
+    finally:
+        screen.backend = old_backend
+
+
+def import_joining():
+    """joining locates Zoom's buttons when imported: give it a fake screen, unless it already has one."""
+    import screen
+    if 'joining' not in sys.modules:
+        screen.backend = screen.FakeBackend(2880, 1800)
+    import joining
+    return joining
+
+
+def check_url_join():
+    """The join opens the zoommtg:// link of the meeting (joining.StubOpener records it), and falls back to
+    Zoom's interface if the link can't be opened or Zoom doesn't join in time. Zoom's window titles come from
+    a stand-in runner, and the timeout passes on the frozen clock."""
+    import utils
+    from model import Meeting, Config, Time
+    from runner import StandInRunner
+    joining = import_joining()
+    zoom, pwd = utils.parse_link('https://example.zoom.us/j/123456789?pwd=a%2Bb.1')
+    meeting = Meeting(Time(8, 0), zoom, pwd=pwd)
+    # Only the first step: the state it moves to is the result.
+    steps = dict(url=joining.zoom_steps(meeting, Config())['url'])
+    old_opener = joining.opener
+    try:
+        utils.runner = StandInRunner(outputs={'osascript': 'Zoom Meeting\n'})
+        joining.opener = joining.StubOpener()
+        assert joining.JoinMachine(steps, 'url').run() == 'close_menu'
+        assert joining.opener.urls == ['zoommtg://zoom.us/join?action=join&confno=123456789&pwd=a%2Bb.1']
+
+        joining.opener = joining.StubOpener(works=False)
+        assert joining.JoinMachine(steps, 'url').run() == 'launch'
+
+        utils.runner = StandInRunner(outputs={'osascript': 'Zoom\n'})
+        joining.opener = joining.StubOpener()
+        assert joining.JoinMachine(steps, 'url').run() == 'launch'
+        assert len(joining.opener.urls) == 1
+    finally:
+        joining.opener = old_opener
+
+
+def check_waker():
+    """With a batch scheduler, the first wake needed submits the wakes of the coming week in one call: the next
+    meetings, and a waker started again (which reads them back from wakes.json), submit nothing. A one-off
+    meeting submits its own wake only. Without batch support, a single wake is submitted every time."""
+    import utils
+    from model import Meeting, Agenda, Time
+    from wake import Waker, RecordingScheduler
+    # Tuesday 09:30 (frozen): Tuesday 14:30, Wednesday 10:00, then Monday 10:00.
+    utils.open_file('Resources/schedule.json', [
+        dict(time=[10, 0], zoom=111111111, name='Standup', days=[1, 3], on_sched=True),
+        dict(time=[14, 30], zoom=222222222, name='Review', days=[2], on_sched=True)])
+    week = [datetime.datetime(2022, 7, 5, 14, 30), datetime.datetime(2022, 7, 6, 10, 0),
+            datetime.datetime(2022, 7, 11, 10, 0)]
+    # The agenda assigns the wake of every occurrence to the same Meeting object: use each one right away.
+    agenda = Agenda()
+    scheduler = RecordingScheduler()
+    waker = Waker(scheduler)
+    waker.ensure(agenda.pop())
+    waker.ensure(agenda.pop())
+    assert scheduler.calls == [week]
+
+    scheduler = RecordingScheduler()
+    last = agenda.pop()
+    Waker(scheduler).ensure(last)
+    assert last.wake_time() == week[2] and scheduler.calls == []
+
+    one_off = Meeting(Time(18, 0), 333333333)
+    one_off.infer_wake()
+    Waker(scheduler).ensure(one_off)
+    assert scheduler.calls == [[datetime.datetime(2022, 7, 5, 18, 0)]]
+
+    # A failed call (e.g. a wrong password) records nothing: the wakes are submitted again.
+    utils.open_file(Waker.path, [])
+    scheduler = RecordingScheduler(works=False)
+    waker = Waker(scheduler)
+    waker.ensure(last)
+    waker.ensure(last)
+    assert scheduler.calls == [week] * 2 and utils.open_file(Waker.path) == []
+
+    scheduler = RecordingScheduler(batch=False)
+    waker = Waker(scheduler)
+    waker.ensure(last)
+    waker.ensure(last)
+    assert scheduler.calls == [[week[2]]] * 2
+
+
+def check_runner():
+    """utils.run, output and sudo go through the runner once set: a stand-in one answers with canned exit codes and
+    outputs, and hands sudo commands to its elevated copy. A real worker runs commands, and times out on a slow one.
+    An elevated runner that fails to start (sudo refused the password) doesn't make utils.sudo raise."""
+    import utils
+    from runner import Runner, StandInRunner
+
+    class DeniedRunner(Runner):
+        def start(self):
+            raise PermissionError('sudo refused the password.')
+
+    utils.runner = StandInRunner(codes={'false': 1}, outputs={'whoami': 'autopilot\n'})
+    assert utils.run('false') == 1 and utils.run('true') == 0
+    assert utils.output('whoami') == 'autopilot'
+    assert utils.sudo('pmset', 'schedule', 'wake', password='hunter2')
+    assert utils.sudo_runner.password == 'hunter2'
+    assert utils.sudo_runner.commands == [['pmset', 'schedule', 'wake']]
+    assert utils.runner.commands == [['false'], ['true'], ['whoami']]
+
+    assert not utils.sudo('false', password='hunter2')
+    utils.sudo_runner = DeniedRunner('wrong')
+    assert not utils.sudo('pmset', 'schedule', 'wake', password='wrong')
+
+    worker = Runner()
+    try:
+        assert worker.call(['echo', 'hi'], capture=True).stdout == 'hi\n'
+        assert worker.call(['false']).code == 1
+        assert worker.call(['/nonexistent/command']).code == 127
+        try:
+            worker.call(['sleep', '2'], timeout=0.2)
+            assert False, 'no timeout'
+        except TimeoutError:
+            pass
+        assert worker.pending == {}
+        assert worker.call(['echo', 'again'], capture=True).stdout == 'again\n'
+        assert len(worker.latencies['echo']) == 2
+    finally:
+        worker.close()
+
+
+def check_agenda():
+    """A wait that the computer slept through (lid closed on Tuesday, opened on Monday) ends late, and the
+    daemon's next pop skips the occurrences that are over by more than the threshold, instead of joining them."""
+    import utils
+    from model import Agenda
+    from wake import wait_for_wake
+    # Tuesday 09:30 (frozen): Tuesday 15:00, Saturday 08:00, then Monday 10:00.
+    utils.open_file('Resources/schedule.json', [
+        dict(time=[15, 0], zoom=111111111, name='Lab', days=[2], on_sched=True),
+        dict(time=[8, 0], zoom=222222222, name='Club', days=[6], on_sched=True),
+        dict(time=[10, 0], zoom=333333333, name='Standup', days=[1], on_sched=True)])
+
+    def close_lid() -> bool:
+        if not utils.clock.suspended:
+            utils.clock.suspend((datetime.datetime(2022, 7, 11, 9, 0) - utils.time()).total_seconds())
+        return False
+
+    agenda, unfiltered = Agenda(), Agenda()
+    lab = agenda.pop(10)
+    assert lab.name == 'Lab' and unfiltered.pop().name == 'Lab'
+    assert not wait_for_wake(lab, utils.clock, close_lid, max_nap=5.).on_time
+    standup = agenda.pop(10)
+    assert standup.name == 'Standup' and standup.wake_time() == datetime.datetime(2022, 7, 11, 10, 0)
+    assert unfiltered.pop().name == 'Club'
+
+
+def check_import_until():
+    """Imported recurrences that end are joined until their last occurrence only (by the lookups, the daemon's
+    agenda and the SQLite store alike), and one-off events are not imported as weekly meetings."""
+    import utils
+    import importer
+    from model import Meeting, Agenda
+    from store import Store
+
+    def event(start: str, rule: Optional[str], zoom: int) -> str:
+        return (f'BEGIN:VEVENT\nDTSTART:{start}\n' + (f'RRULE:{rule}\n' if rule else '') +
+                f'SUMMARY:Event {zoom}\nDESCRIPTION:https://example.zoom.us/j/{zoom}\nEND:VEVENT\n')
+
+    utils.open_file('Resources/schedule.json', [])
+    path = utils.full_path('Resources/calendar.ics')
+    with open(path, 'w') as f:
+        f.write('BEGIN:VCALENDAR\n' +
+                event('20220720T100000', None, 111111111) +
+                event('20220704T110000', 'FREQ=WEEKLY;BYDAY=MO,WE;UNTIL=20221216', 222222222) +
+                event('20220705T140000', 'FREQ=WEEKLY;BYDAY=TU;COUNT=3', 333333333) +
+                event('20220701T080000', 'FREQ=DAILY;COUNT=5', 444444444) +
+                'END:VCALENDAR\n')
+    counts = importer.import_file(path)
+    assert (counts['added'], counts['skipped'], counts['past']) == (2, 1, 1)
+    assert [entry['until'] for entry in utils.open_file('Resources/schedule.json')] == \
+        ['2022-12-14T11:00', '2022-07-19T14:00']
+
+    utils.clock.advance_to(datetime.datetime(2022, 7, 19, 15, 0))
+    agenda = Agenda()
+    assert [agenda.pop().wake_time() for _ in range(2)] == \
+        [datetime.datetime(2022, 7, 20, 11, 0), datetime.datetime(2022, 7, 25, 11, 0)]
+    assert Meeting.next().zoom == 222222222
+    assert Meeting.schedule_of_day(2) == []
+
+    Meeting.store = Store()
+    try:
+        assert Meeting.next().zoom == 222222222
+        assert Meeting.schedule_of_day(2) == []
+        utils.clock.advance_to(datetime.datetime(2022, 12, 15, 9, 0))
+        assert Meeting.next() is None
+    finally:
+        Meeting.store.db.close()
+        Meeting.store = None
+    assert Meeting.next() is None and Agenda().pop() is None
+
+
+class StandInSMTP(socketserver.ThreadingTCPServer):
+    """A local SMTP server that keeps the messages it receives, for checking postjoin.Notifier. It offers
+    neither STARTTLS nor AUTH, so the notifier sends in the clear and without login. drop closes the open
+    connections, like a server that timed them out."""
+    daemon_threads = True
+
+    class Handler(socketserver.StreamRequestHandler):
+        def reply(self, line: str):
+            self.wfile.write(line.encode() + b'\r\n')
+
+        def handle(self):
+            self.server.connections.append(self.connection)
+            try:
+                self.converse()
+            except OSError:
+                # Dropped (see drop).
+                pass
+
+        def converse(self):
+            self.reply('220 localhost ESMTP')
+            for line in self.rfile:
+                command = line.decode().strip().upper()
+                if command.startswith('EHLO'):
+                    self.reply('250-localhost')
+                    self.reply('250 8BITMIME')
+                elif command == 'DATA':
+                    self.reply('354 End data with <CR><LF>.<CR><LF>')
+                    lines = []
+                    for data in self.rfile:
+                        if data.rstrip(b'\r\n') == b'.':
+                            break
+                        lines.append(data.decode())
+                    self.server.messages.append(''.join(lines))
+                    self.reply('250 OK')
+                elif command == 'QUIT':
+                    self.reply('221 Bye')
+                    return
+                else:
+                    self.reply('250 OK')
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), self.Handler)
+        self.messages: List[str] = []
+        self.connections = []
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def drop(self):
+        for connection in self.connections:
+            connection.shutdown(socket.SHUT_RDWR)
+        self.connections = []
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+
+def check_followup():
+    """The follow-up tasks of a join run in the background: drain returns the results of every batch, even of those
+    that ended before the next was submitted, with the exceptions of the tasks that failed or timed out. Emails
+    go through one connection to a stand-in SMTP server, opened again if the server dropped it."""
+    import asyncio
+    import time
+    from postjoin import Pipeline, Notifier
+
+    def fail():
+        raise OSError('disk full')
+
+    smtp = StandInSMTP()
+    notifier = Notifier('autopilot@example.com', host='127.0.0.1', port=smtp.port)
+    pipeline = Pipeline(timeout=0.5)
+    try:
+        first = pipeline.submit(dict(notify=lambda: notifier.send('me@example.com', 'Joined', 'First')))
+        first.result(5)
+        pipeline.submit(dict(notify=lambda: notifier.send('me@example.com', 'Joined', 'Second'),
+                             cleanup=fail, history=lambda: time.sleep(2)))
+        batches = pipeline.drain(5)
+        assert len(batches) == 2 and batches[0] == dict(notify=None)
+        assert batches[1]['notify'] is None and isinstance(batches[1]['cleanup'], OSError)
+        assert isinstance(batches[1]['history'], asyncio.TimeoutError)
+        assert pipeline.drain(0) == []
+        assert len(smtp.messages) == 2 and 'Subject: Joined' in smtp.messages[1]
+        assert notifier.connections == 1
+
+        smtp.drop()
+        notifier.send('me@example.com', 'Joined', 'Third')
+        assert len(smtp.messages) == 3 and 'Third' in smtp.messages[2]
+        assert notifier.connections == 2
+    finally:
+        notifier.close()
+        smtp.close()
+
+
+def check_gui_join():
+    """Through Zoom's interface on a screen other than 1440x900, where the leave buttons aren't at their usual
+    positions (and aren't searched for), the join is confirmed by the title of the meeting window."""
+    import utils
+    import screen
+    from model import Meeting, Config, Time
+    from runner import StandInRunner
+    joining = import_joining()
+    meeting = Meeting(Time(8, 0), 123456789)
+    # The step as is, without pressing enter.
+    enter = joining.zoom_steps(meeting, Config())['enter']
+    steps = dict(enter=joining.Step(joining.nothing, enter.conditions, enter.timeout, enter.retries, enter.then,
+                                    enter.default, enter.on_timeout))
+    old_backend, screen.backend = screen.backend, screen.FakeBackend(3840, 2400)
+    try:
+        utils.runner = StandInRunner(outputs={'osascript': 'Zoom Meeting\n'})
+        assert joining.JoinMachine(steps, 'enter').run() == 'settle'
+
+        utils.runner = StandInRunner(outputs={'osascript': 'Zoom\n'})
+        machine = joining.JoinMachine(steps, 'enter')
+        assert machine.run() is None and machine.failed == 'enter'
+    finally:
+        screen.backend = old_backend
+
+
+def run_checks() -> Dict[str, Optional[str]]:
+    """Run every check (the check_ functions) in a sandbox. Returns the error of every check, None if it passed."""
+    results = {}
+    for name, check in list(globals().items()):
+        if not name.startswith('check_'):
+            continue
+        with sandbox():
+            try:
+                check()
+                results[name[6:]] = None
+            except Exception:
+                results[name[6:]] = traceback.format_exc(limit=-2)
+    return results
+
+
+def print_checks(results: Dict[str, Optional[str]]):
+    for name, error in results.items():
+        print(f'{name:<40} ' + ('ok' if error is None else f'FAILED\n{error}'))
+
+
+# COMPARISON
+
+
+def regressions(results: Dict[str, Optional[dict]], baseline: Dict[str, Optional[dict]],
+                threshold: float, key: str) -> List[str]:
+    """Names of the results whose key value grew more than threshold (a fraction) over the baseline."""
+    slower = []
+    for name, result in results.items():
+        old = baseline.get(name)
+        if result is None or old is None:
+            continue
+        if result[key] > old[key] * (1 + threshold):
+            slower.append(f'{name}: {old[key]} -> {result[key]}')
+    return slower
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(prog='testing.py')
+    parser.add_argument('suite', choices=['importtime', 'bench', 'check'])
+    parser.add_argument('--sizes', type=int, nargs='+', default=sizes,
+                        help='schedule sizes for the bench suite')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='baseline JSON file to compare the results with')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='allowed slowdown over the baseline, defaults to 0.2 (20%%)')
+    args = parser.parse_args(argv)
+
+    if args.suite == 'check':
+        results = run_checks()
+        print_checks(results)
+        return int(any(results.values()))
+
+    if args.suite == 'importtime':
+        results = import_times(modules)
+        print_import_times(results)
+        key = 'total'
+    else:
+        results = bench(args.sizes)
+        print_bench(results)
+        key = 'us'
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        slower = regressions(results, baseline, args.threshold, key)
+        if slower:
+            print('\nRegressions:\n' + '\n'.join(slower))
+            return 1
+        print('\nNo regressions.')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,60 @@
+from typing import Any, Optional, Iterator, Dict, List
+from contextlib import contextmanager
+from time import monotonic
+import os
+import sys
+import json
+import atexit
+
+
+class Tracer:
+    """Span-based tracing for the join pipeline, enabled with --trace. Every span is written to a
+    JSONL file as it ends, with monotonic timestamps (seconds), and a summary table is printed at exit.
+    While disabled, spans cost next to nothing."""
+    def __init__(self):
+        self.file = None
+        self.depth = 0
+        self.durations: Dict[str, List[float]] = {}
+
+    def start(self, path: str):
+        self.file = open(path, 'a', buffering=1)
+        self.event('run', pid=os.getpid(), argv=sys.argv[1:])
+        atexit.register(self.stop)
+
+    def stop(self):
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+        self.print_summary()
+
+    def event(self, kind: str, **fields: Any):
+        self.file.write(json.dumps(dict(event=kind, t=monotonic(), **fields)) + '\n')
+
+    @contextmanager
+    def span(self, name: str, **attrs: Any) -> Iterator[None]:
+        """Time the code inside the with statement."""
+        if self.file is None:
+            yield
+            return
+        start = monotonic()
+        self.depth += 1
+        try:
+            yield
+        finally:
+            self.depth -= 1
+            end = monotonic()
+            self.durations.setdefault(name, []).append(end - start)
+            if self.file is not None:
+                self.event('span', name=name, start=start, end=end, depth=self.depth, attrs=attrs)
+
+    def print_summary(self, out: Optional[Any] = None):
+        out = out or sys.stderr
+        out.write(f'\n{"Phase":<24}{"Count":>7}{"Total (s)":>12}{"Mean (s)":>12}{"Max (s)":>12}\n')
+        for name, durations in self.durations.items():
+            out.write(f'{name:<24}{len(durations):>7}{sum(durations):>12.3f}'
+                      f'{sum(durations) / len(durations):>12.3f}{max(durations):>12.3f}\n')
+
+
+tracer = Tracer()
+span = tracer.span
@@ -1,15 +1,46 @@
-from typing import Any, Union, Optional, NoReturn, Tuple, List
-from time import sleep
+from typing import Any, Union, Optional, NoReturn, Callable, Tuple, List, Dict
+from time import sleep, monotonic
+from itertools import accumulate
 import sys
+import os
 import subprocess
 import datetime
 import json
 import re
 import getpass
-
-import pyautogui as pag
+import importlib
+from collections import OrderedDict
+from urllib.parse import unquote
+
+
+class LazyModule:
+    """Stand-in for a module that is only imported on first use. Attributes set before that
+    (e.g. pag.PAUSE) are kept and applied once the module is loaded."""
+    def __init__(self, name: str):
+        object.__setattr__(self, '_name', name)
+        object.__setattr__(self, '_module', None)
+        object.__setattr__(self, '_pending', {})
+
+    def _load(self):
+        if self._module is None:
+            module = importlib.import_module(self._name)
+            for key, value in self._pending.items():
+                setattr(module, key, value)
+            object.__setattr__(self, '_module', module)
+        return self._module
+
+    def __getattr__(self, item: str) -> Any:
+        return getattr(self._load(), item)
+
+    def __setattr__(self, key: str, value: Any):
+        if self._module is None:
+            self._pending[key] = value
+            return
+        setattr(self._module, key, value)
 
 
+# PyAutoGUI (and PIL with it) is slow to import, and only needed to join meetings.
+pag = LazyModule('pyautogui')
 sources_path = f'/Users/{getpass.getuser()}/Library/com.UmActually.Autopilot/'
 sys.tracebacklimit = 0
 factor = 2
@@ -18,19 +49,85 @@ factor = 2
 # GENERAL FUNCS
 
 
-def run(executable: str, *args: str):
-    """Run a command."""
-    subprocess.run([executable, *args], text=True, stderr=subprocess.DEVNULL)
+# Command runners (see runner.py). The privileged one, once set, keeps a sudo worker for every sudo call. The other
+# one takes every command, for testing with a stand-in; by default, a new subprocess runs each command.
+runner: Any = None
+sudo_runner: Any = None
+
+
+def run(executable: str, *args: str) -> int:
+    """Run a command. Returns its exit code."""
+    if runner is not None:
+        return runner.call([executable, *args]).code
+    return subprocess.run([executable, *args], text=True, stderr=subprocess.DEVNULL).returncode
+
+
+def output(executable: str, *args: str) -> str:
+    """Run a command and return what it printed, without the trailing newline."""
+    if runner is not None:
+        return runner.call([executable, *args], capture=True).stdout.rstrip('\n')
+    proc = subprocess.run([executable, *args], text=True, capture_output=True)
+    return proc.stdout.rstrip('\n')
+
+
+def sudo(executable: str, *args: str, password: str) -> bool:
+    """Run a command with sudo. Returns whether it succeeded: a failure (e.g. a wrong password) is not raised."""
+    global sudo_runner
+    if sudo_runner is None and runner is not None:
+        sudo_runner = runner.elevated(password)
+    if sudo_runner is not None:
+        try:
+            return sudo_runner.call([executable, *args]).code == 0
+        except (ConnectionError, PermissionError, TimeoutError):
+            return False
+    return subprocess.run(['sudo', '-S', executable, *args], input=password, text=True,
+                          stderr=subprocess.DEVNULL).returncode == 0
+
+
+class Clock:
+    """Source of time for every scheduling decision: wall clock, monotonic clock and sleeping."""
+    def now(self) -> datetime.datetime:
+        return datetime.datetime.now()
+
+    def monotonic(self) -> float:
+        return monotonic()
+
+    def sleep(self, seconds: float):
+        sleep(seconds)
+
+
+class VirtualClock(Clock):
+    """Simulated time, starting at the given date. Sleeping advances the clock instantly,
+    so days of waiting take milliseconds. Without sleeping, the time is frozen."""
+    def __init__(self, start: datetime.datetime):
+        self.start = start
+        self.elapsed = 0.
+        self.suspended = 0.
+
+    def now(self) -> datetime.datetime:
+        return self.start + datetime.timedelta(seconds=self.elapsed + self.suspended)
 
+    def monotonic(self) -> float:
+        return self.elapsed
 
-def sudo(executable: str, *args: str, password: str):
-    """Run a command with sudo."""
-    subprocess.run(['sudo', '-S', executable, *args], input=password, text=True, stderr=subprocess.DEVNULL)
+    def sleep(self, seconds: float):
+        self.elapsed += max(seconds, 0)
+
+    def suspend(self, seconds: float):
+        """Advance the wall clock only, like a computer that was asleep."""
+        self.suspended += seconds
+
+    def advance_to(self, date: datetime.datetime):
+        """Let time pass until the given date, if it is in the future."""
+        self.sleep((date - self.now()).total_seconds())
+
+
+clock: Clock = Clock()
 
 
 def time() -> datetime.datetime:
     """Current date & time as datetime object."""
-    return datetime.datetime.now()
+    return clock.now()
 
 
 def time_string() -> str:
@@ -38,38 +135,115 @@ def time_string() -> str:
     return time().time().strftime("%H:%M:%S")
 
 
-def open_file(path: str, write: Optional[Union[str, list, dict]] = None) -> Optional[Union[str, list, dict]]:
-    """Read and write in file. If file is JSON, parse with the json module."""
+def full_path(path: str) -> str:
+    """Resolve a path relative to the Autopilot sources folder."""
     if not path.startswith('/'):
         path = sources_path + path
+    return path
+
+
+def file_stamp(path: str) -> Optional[Tuple[int, int]]:
+    """Modification time and size of a file, to tell whether it changed. None if missing."""
+    try:
+        stat = os.stat(full_path(path))
+    except FileNotFoundError:
+        return
+    return stat.st_mtime_ns, stat.st_size
+
+
+# Process-wide cache of parsed files: path -> (file stamp, content). Least recently used entries are dropped.
+cache = OrderedDict()
+cache_size = 32
+cache_stats = {'hits': 0, 'misses': 0}
+
+
+def _cache_put(path: str, stamp: Tuple[int, int], content: Union[str, list, dict]):
+    cache[path] = stamp, content
+    cache.move_to_end(path)
+    if len(cache) > cache_size:
+        cache.popitem(last=False)
+
+
+def open_file(path: str, write: Optional[Union[str, list, dict]] = None) -> Optional[Union[str, list, dict]]:
+    """Read and write in file. If file is JSON, parse with the json module. Writes are atomic.
+    Contents are cached, and only read again when the file's mtime or size changes. The returned
+    objects are shared, so copy them before making changes; written objects are cached as they are."""
+    path = full_path(path)
     is_json = path.endswith('.json')
 
     if write is not None:
-        with open(path, 'w') as f:
-            if is_json:
-                json.dump(write, f)
-            else:
-                f.write(write)
+        # Write to a temporary file and rename it, so that the file is never left half-written.
+        temp = f'{path}.{os.getpid()}.tmp'
+        try:
+            with open(temp, 'w') as f:
+                if is_json:
+                    json.dump(write, f)
+                else:
+                    f.write(write)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp, path)
+        except BaseException:
+            if os.path.exists(temp):
+                os.remove(temp)
+            raise
+        _cache_put(path, file_stamp(path), write)
         return
 
+    stamp = file_stamp(path)
+    entry = cache.get(path)
+    if entry is not None and entry[0] == stamp:
+        cache_stats['hits'] += 1
+        cache.move_to_end(path)
+        return entry[1]
+    cache_stats['misses'] += 1
+
     with open(path) as f:
         if is_json:
             content = json.load(f)
         else:
             content = f.read()
+    if stamp is not None:
+        _cache_put(path, stamp, content)
     return content
 
 
-def parse_id(zoom: str) -> int:
-    """Parse meeting IDs, remove the link part."""
+def parse_link(zoom: str) -> Tuple[int, Optional[str]]:
+    """Parse meeting IDs, remove the link part. The passcode (pwd parameter) of the link is kept, if any,
+    without the percent-encoding of the link."""
     zoom = zoom.strip(' \n').replace(' ', '')
+    pwd = None
     if zoom.startswith('https://') or 'zoom.us' in zoom:
+        re_match = re.search(r'[?&]pwd=([^&#]+)', zoom)
+        if re_match is not None:
+            pwd = unquote(re_match.group(1))
         re_match = re.search(r'\d{5,}', zoom)
         if re_match is None:
             raise ValueError
         span = re_match.span()
         zoom = zoom[span[0]:span[1]]
-    return int(zoom)
+    return int(zoom), pwd
+
+
+def parse_id(zoom: str) -> int:
+    """Parse meeting IDs, remove the link part."""
+    return parse_link(zoom)[0]
+
+
+zoom_link = re.compile(r'https?://[\w.-]*zoom\.us/[jw]/\d+[^\s<>"\'\\]*')
+zoom_id = re.compile(r'(?i)(?:meeting\s*id|id\s*de\s*reuni[oó]n)\W*(\d[\d ]{7,}\d)')
+
+
+def find_id(text: str) -> Optional[Tuple[int, Optional[str]]]:
+    """Look for a Zoom link (or else a "Meeting ID: ...") in free text, like a calendar event description.
+    Returns the meeting ID and passcode, like parse_link, or None if there is none."""
+    match = zoom_link.search(text)
+    if match is None:
+        match = zoom_id.search(text)
+        if match is None:
+            return
+        return parse_link(match.group(1))
+    return parse_link(match.group())
 
 
 def raise_val_err(case: int) -> NoReturn:
@@ -84,6 +258,62 @@ def raise_val_err(case: int) -> NoReturn:
     exit(1)
 
 
+class Alarm:
+    """Sleep until an absolute wall-clock deadline. Every nap is half of the time left, capped by max_nap, so the
+    last naps shrink toward the deadline and the last one lands on time. After every nap the monotonic and wall
+    clocks are compared: if they disagree, the wall clock jumped or the computer was suspended, and the alarm
+    re-arms from the new wall time.
+    Sleeping stops counting while the computer is suspended, so a nap that began before a suspend ends up to
+    max_nap seconds after the computer wakes up: waits that may span a suspend need a small max_nap. Without
+    one (e.g. on a virtual clock), a wait costs about log2 of its seconds in wakeups."""
+    def __init__(self, deadline: datetime.datetime, max_nap: Optional[float] = None, tolerance=2.,
+                 source: Optional[Clock] = None):
+        self.deadline = deadline
+        self.max_nap = max_nap
+        self.tolerance = tolerance
+        # The clock to sleep on, utils.clock (at the time of waiting) by default.
+        self.source = source
+        self.wakeups = 0
+        self.jumps = 0
+        self.elapsed = 0.
+        self.interrupted = False
+        self.on_time = True
+
+    def wait(self, interrupt: Optional[Callable[[], bool]] = None) -> bool:
+        """Sleep until the deadline. Returns False if a clock jump (e.g. the computer was asleep)
+        carried the wait past the deadline by more than the tolerance, and True otherwise (also kept
+        as the on_time attribute). The interrupt function, if given, is checked after every nap; when
+        it returns True the wait ends early and the interrupted attribute is set."""
+        source = clock if self.source is None else self.source
+        start = mono = source.monotonic()
+        wall = source.now()
+        jumped = False
+        self.interrupted = False
+        while True:
+            remaining = (self.deadline - wall).total_seconds()
+            if remaining <= 0:
+                break
+            if interrupt is not None and interrupt():
+                self.interrupted = True
+                break
+            nap = remaining if remaining <= 1 else remaining / 2
+            source.sleep(nap if self.max_nap is None else min(nap, self.max_nap))
+            self.wakeups += 1
+            new_mono, new_wall = source.monotonic(), source.now()
+            drift = (new_wall - wall).total_seconds() - (new_mono - mono)
+            jumped = abs(drift) > self.tolerance
+            self.jumps += jumped
+            mono, wall = new_mono, new_wall
+        self.elapsed += source.monotonic() - start
+        self.on_time = not (jumped and -remaining > self.tolerance)
+        return self.on_time
+
+    def wakeups_per_hour(self) -> float:
+        if not self.elapsed:
+            return 0.
+        return self.wakeups * 3600 / self.elapsed
+
+
 def distribute_list(any_list: list, n=3) -> List[list]:
     """Convert a list into a list of lists with n elements each."""
     resp = []
@@ -110,6 +340,17 @@ def open_app(name: str):
     run('open', f'/Applications/{name}.app')
 
 
+def open_url(url: str) -> bool:
+    """Open a URL with its default app. Returns False if it couldn't be opened."""
+    return run('open', url) == 0
+
+
+def front_window(process: str) -> str:
+    """Title of the front window of an app process, or an empty string if it has none."""
+    return output('osascript', '-e',
+                  f'tell application "System Events" to get name of front window of process "{process}"')
+
+
 def get_pos():
     """Print the mouse pos every two seconds."""
     while True:
@@ -127,20 +368,69 @@ def get_rgb():
 
 
 def color_match(x: int, y: int, r: int, g: int, b: int, tolerance=5) -> bool:
-    """Check if pixel (x, y) currently has color values (r, g, b)."""
-    return pag.pixelMatchesColor(x * factor, y * factor, (r, g, b), tolerance=tolerance)
+    """Check if pixel (x, y) currently has color values (r, g, b).
+    To check several pixels at once, use a screen.Probes batch instead."""
+    import screen
+    return screen.Probes(screen.Probe(x, y, (r, g, b), tolerance)).all()
+
+
+def wait_for(conditions: Dict[str, Any], timeout: float, fast=0.05, slow=1.) -> Optional[str]:
+    """Wait until one of the named conditions is satisfied, and return its name. If several match at once,
+    the first one given wins. A condition is either a screen.Probes, all of which must match (every Probes
+    is checked with a single capture), or a function that returns a bool. Polling starts every fast seconds,
+    right after an action, and backs off up to every slow seconds while nothing changes: neither the probed
+    pixels nor the functions, which keep returning False until they match (e.g. a window title check,
+    which runs a process every time). Elements of Zoom that haven't been located yet (screen.Search) are
+    probed at their usual position; once the screen settles without them, they are looked for over the whole
+    screen, which is only done again if the probed pixels change. Returns None once timeout seconds have passed."""
+    import screen
+    names = list(conditions)
+    probed = [name for name in names if isinstance(conditions[name], screen.Probes)]
+    batch = screen.Probes(*[p for name in probed for p in conditions[name].probes]) if probed else None
+    bounds = [0, *accumulate(len(conditions[name].probes) for name in probed)]
+    spans = {name: (bounds[k], bounds[k + 1]) for k, name in enumerate(probed)}
+    searches = [conditions[name] for name in probed if isinstance(conditions[name], screen.Search)]
+    deadline = clock.monotonic() + timeout
+    interval = fast
+    last = pixels = None
+    scanned = False
+    while True:
+        if batch is not None:
+            pixels = batch.sample()
+            matches = batch.match(pixels)
+        for name in names:
+            if name in spans:
+                start, end = spans[name]
+                if matches[start:end].all():
+                    if isinstance(conditions[name], screen.Search):
+                        conditions[name].record()
+                    return name
+            elif conditions[name]():
+                return name
+        remaining = deadline - clock.monotonic()
+        if remaining <= 0:
+            return
+        if pixels is not None and (last is None or (pixels != last).any()):
+            interval = fast
+            scanned = False
+        else:
+            interval = min(interval * 2, slow)
+        last = pixels
+        if searches and not scanned and interval >= slow:
+            scanned = True
+            found = screen.scan(searches)
+            for name in probed:
+                if conditions[name] in found:
+                    return name
+        clock.sleep(min(interval, remaining))
 
 
 def wait_until_color(
         x: int, y: int, r: int, g: int, b: int, interval=1, tolerance=5, timeout=0) -> bool:
-    """Wait until the color match satisfies."""
-    k = 0
-    while not color_match(x, y, r, g, b, tolerance):
-        k += 1
-        sleep(interval)
-        if timeout and k >= timeout:
-            return False
-    return True
+    """Wait until the color match satisfies. With no timeout, wait indefinitely."""
+    import screen
+    condition = screen.Probes(screen.Probe(x, y, (r, g, b), tolerance))
+    return wait_for({'color': condition}, timeout or float('inf'), slow=interval) is not None
 
 
 def hotkey(*keys: str, wait=0.3):
@@ -211,18 +501,49 @@ def change_wake_time(new_time):
 
 def clear_term():
     """Clear terminal in a fancy way."""
+    global term_clears
+    term_clears += 1
     print('\033c', end='')
 
 
+term_clears = 0
+
+
+class Screen:
+    """A view that is redrawn in place: only the lines that changed since the last draw are written.
+    The whole view is drawn again if the terminal was cleared in between (see clear_term)."""
+    def __init__(self):
+        self.lines: Optional[List[str]] = None
+        self.clears = term_clears
+
+    def draw(self, text: str):
+        """Show the text, leaving the cursor at the start of its last line (cleared), e.g. for a prompt.
+        The text must fit in the terminal."""
+        lines = text.split('\n')
+        if self.lines is None or self.clears != term_clears:
+            chunks = ['\033[H\033[2J', '\n'.join(lines[:-1]), '\n']
+        else:
+            chunks = [f'\033[{row + 1};1H{line}\033[K' for row, line in enumerate(lines[:-1])
+                      if row >= len(self.lines) - 1 or line != self.lines[row]]
+            chunks.append(f'\033[{len(lines)};1H')
+        chunks.append('\033[J' + lines[-1])
+        sys.stdout.write(''.join(chunks))
+        sys.stdout.flush()
+        self.lines = lines
+        self.clears = term_clears
+
+
 def pseudo_markdown(text: str) -> str:
     """Replace "markdown" chars in the program's text files."""
     return text.replace('<b>', '\033[1m').replace('</b>', '\033[0m')
 
 
 def never_trust_user_input(
-        text: str, limits: Tuple[int, int], *special: str, end='\n\n') -> Union[int, str]:
+        text: str, limits: Tuple[int, int], *special: str, end='\n\n',
+        screen: Optional[Screen] = None) -> Union[int, str]:
     """Ask for a choice out of a list of ints or "special" strs. Whenever an invalid input
-    is given, the terminal is cleared and input is prompted again."""
+    is given, the terminal is cleared and input is prompted again. With a screen, the text is
+    redrawn in place instead, writing only what changed since the last prompt."""
     if limits[0] == limits[1]:
         prompt = f'Choice? ({limits[0]}'
     else:
@@ -231,8 +552,11 @@ def never_trust_user_input(
         prompt += f' or {", ".join(special)}'
     prompt += ') '
     while True:
-        clear_term()
-        print(text, end=end)
+        if screen is None:
+            clear_term()
+            print(text, end=end)
+        else:
+            screen.draw(text + end)
         choice = input(prompt)
         if choice in special:
             return choice
@@ -0,0 +1,122 @@
+from typing import Optional, Callable, List, Set
+import shlex
+import datetime
+
+from model import Meeting, Agenda, Time
+from tracing import span
+import utils
+
+
+class Scheduler:
+    """Schedules wakes of the computer. Schedulers with batch support take many wakes in one call."""
+    batch = False
+
+    def schedule(self, wakes: List[datetime.datetime]) -> bool:
+        """Schedule the wakes (sorted, in the future). Returns whether they were."""
+        raise NotImplementedError
+
+
+class PmsetScheduler(Scheduler):
+    """Schedules the wakes with pmset, all of them in a single sudo call."""
+    batch = True
+
+    def __init__(self, password: str):
+        self.password = password
+
+    def schedule(self, wakes: List[datetime.datetime]) -> bool:
+        commands = [f'pmset schedule wake {shlex.quote(wake.strftime("%m/%d/%y %H:%M:%S"))}' for wake in wakes]
+        # The exit code is that of the first command that failed, if any.
+        return utils.sudo('sh', '-c', ' && '.join(commands), password=self.password)
+
+
+class GUIScheduler(Scheduler):
+    """Sets the daily wake time of System Preferences, for users who'd rather not give their password.
+    There is a single such time, so only the first wake is scheduled. Going through the interface, it can't
+    tell whether that worked."""
+    def schedule(self, wakes: List[datetime.datetime]) -> bool:
+        utils.change_wake_time(Time(wakes[0].hour, wakes[0].minute))
+        return True
+
+
+class RecordingScheduler(Scheduler):
+    """Records the calls instead of scheduling anything, for testing and simulations. With works=False,
+    every call fails, like pmset with a wrong password."""
+    def __init__(self, batch=True, works=True):
+        self.batch = batch
+        self.works = works
+        self.calls: List[List[datetime.datetime]] = []
+
+    def schedule(self, wakes: List[datetime.datetime]) -> bool:
+        self.calls.append(list(wakes))
+        return self.works
+
+
+class Waker:
+    """Makes sure the computer wakes up for meetings. With a batch scheduler, the first wake needed for a meeting
+    of the schedule submits the wakes of the whole coming week: the following meetings find theirs already there.
+    Submitted wakes are remembered (Resources/wakes.json), so they are never submitted twice, across runs too."""
+    path = 'Resources/wakes.json'
+
+    def __init__(self, scheduler: Scheduler):
+        self.scheduler = scheduler
+        stored = []
+        if scheduler.batch:
+            try:
+                stored = utils.open_file(self.path)
+            except (OSError, ValueError):
+                pass
+        now = utils.time()
+        self.scheduled: Set[datetime.datetime] = {
+            wake for wake in map(datetime.datetime.fromisoformat, stored) if wake > now}
+
+    def week(self) -> List[datetime.datetime]:
+        """The wakes of every meeting of the schedule, over the coming week."""
+        agenda = Agenda()
+        agenda.refresh()
+        return [when for when, _, _ in agenda.heap]
+
+    def ensure(self, meeting: Meeting):
+        """Schedule the wake of the meeting (and of the coming week, in batch mode), unless already done."""
+        wake = meeting.wake_time()
+        if wake in self.scheduled:
+            return
+        wakes = {wake}
+        if self.scheduler.batch and meeting.is_on_sched:
+            wakes.update(self.week())
+        now = utils.time()
+        wakes = sorted(w for w in wakes if w > now and w not in self.scheduled)
+        if not wakes:
+            return
+        scheduled = self.scheduler.schedule(wakes if self.scheduler.batch else wakes[:1])
+        if not scheduled or not self.scheduler.batch:
+            # Failed wakes are tried again by the next ensure. Without batch support, only one wake was
+            # scheduled, and a daily time can't be trusted to still be there later.
+            return
+        self.scheduled = {w for w in self.scheduled if w > now}.union(wakes)
+        utils.open_file(self.path, [w.isoformat() for w in sorted(self.scheduled)])
+
+
+def wait_for_wake(meeting: Meeting, clock: utils.Clock, interrupt: Optional[Callable[[], bool]] = None,
+                  announce: Optional[Callable[[], None]] = None, lock: Optional[Callable[[], None]] = None,
+                  max_nap: Optional[float] = None) -> utils.Alarm:
+    """Sleep on the clock until the wake time of the meeting (for main.wait_for_meeting and the simulator).
+    If the computer is still awake one minute before it, announce is called, and two seconds before it, lock
+    is (to lock the screen, so that typing the password wakes the display); then the screen gets one second.
+    Naps last at most max_nap seconds (the sleep interval of the config, see utils.Alarm).
+    Returns the alarm: interrupted is set if the interrupt function ended the wait early, and on_time is
+    False if the computer was asleep past the last minute."""
+    wake = meeting.wake_time()
+    alarm = utils.Alarm(wake - datetime.timedelta(minutes=1), max_nap=max_nap, source=clock)
+    with span('wait'):
+        alarm.wait(interrupt)
+    if alarm.interrupted or not alarm.on_time:
+        return alarm
+    with span('last_minute'):
+        if announce is not None:
+            announce()
+        alarm.deadline = wake - datetime.timedelta(seconds=2)
+        alarm.wait()
+        if lock is not None:
+            lock()
+        clock.sleep(1)
+    return alarm